@@ -0,0 +1,97 @@
+# Микро-бенчмарк: сколько стоит маршрутизация одного callback_query.
+# Сравнивает словарь CALLBACK_ROUTES с прежней цепочкой if'ов из process_callback_query.
+# Тела обработчиков заменены на пустые - меряется только разбор callback_data, поиск ветки и проверка админа.
+# Запуск: python bench/bench_callback_routing.py [итераций]
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+from botmodule import load_bot
+
+bot_module = load_bot()
+check_admin = bot_module.check_admin
+
+SAMPLES = [
+    "back_to_main",
+    "start_report",
+    "report_preset:Мошенничество",
+    "admin_panel",
+    "admin_reports:3:n:1777636984567891:1234",
+    "view_report:1234",
+    "report_action:approve:1234",
+    "admin_banlist:0",
+    "user_action:ban:42",
+    "noop",
+]
+
+async def handled(*args):
+    pass
+
+# Прежняя цепочка: те же условия в том же порядке, с повторными split(":") и check_admin в каждой ветке
+async def legacy_chain(callback, state):
+    if callback.data == "back_to_main":
+        await check_admin(callback.from_user.id); await handled(); return
+    if callback.data == "start_report":
+        await handled(); return
+    if callback.data.startswith("report_preset:"):
+        reason = callback.data.split(":")[1]; await handled(reason); return
+    if callback.data == "report_custom":
+        await handled(); return
+    if callback.data == "admin_panel":
+        if not await check_admin(callback.from_user.id): return
+        await handled(); return
+    if callback.data.startswith("admin_reports:"):
+        if not await check_admin(callback.from_user.id): return
+        page = int(callback.data.split(":")[1]); await handled(page); return
+    if callback.data.startswith("view_report:"):
+        if not await check_admin(callback.from_user.id): return
+        report_id = int(callback.data.split(":")[1]); await handled(report_id); return
+    if callback.data.startswith("report_action:"):
+        if not await check_admin(callback.from_user.id): return
+        action = callback.data.split(":")[1]; report_id = int(callback.data.split(":")[2]); await handled(action, report_id); return
+    if callback.data.startswith("admin_users:"):
+        if not await check_admin(callback.from_user.id): return
+        page = int(callback.data.split(":")[1]); await handled(page); return
+    if callback.data.startswith("admin_banlist:"):
+        if not await check_admin(callback.from_user.id): return
+        page = int(callback.data.split(":")[1]); await handled(page); return
+    if callback.data.startswith("view_user:"):
+        if not await check_admin(callback.from_user.id): return
+        user_id = int(callback.data.split(":")[1]); await handled(user_id); return
+    if callback.data.startswith("user_action:"):
+        if not await check_admin(callback.from_user.id): return
+        action = callback.data.split(":")[1]; user_id = int(callback.data.split(":")[2]); await handled(action, user_id); return
+    if callback.data == "admin_fast_approve":
+        if not await check_admin(callback.from_user.id): return
+        await handled(); return
+    if callback.data == "noop":
+        await handled(); return
+
+async def measure(route, callbacks, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for callback in callbacks:
+            await route(callback, None)
+    return (time.perf_counter() - start) / (iterations * len(callbacks)) * 1e9
+
+async def main(iterations: int):
+    # Подменяем обработчики пустыми, сохраняя флаги доступа
+    for prefix, (handler, admin_only, denied_text) in list(bot_module.CALLBACK_ROUTES.items()):
+        bot_module.CALLBACK_ROUTES[prefix] = (handled, admin_only, denied_text)
+    admin = SimpleNamespace(id=bot_module.ADMIN_ID)
+    callbacks = [SimpleNamespace(data=data, from_user=admin, answer=handled) for data in SAMPLES]
+
+    await measure(legacy_chain, callbacks, iterations // 10) # Прогрев
+    await measure(bot_module.process_callback_query, callbacks, iterations // 10)
+    legacy = await measure(legacy_chain, callbacks, iterations)
+    routed = await measure(bot_module.process_callback_query, callbacks, iterations)
+    print(f"Цепочка if'ов:     {legacy:8.0f} нс/callback")
+    print(f"CALLBACK_ROUTES:   {routed:8.0f} нс/callback ({legacy / routed:.2f}x)")
+    for callback in callbacks:
+        single_legacy = await measure(legacy_chain, [callback], iterations // 10)
+        single_routed = await measure(bot_module.process_callback_query, [callback], iterations // 10)
+        print(f"  {callback.data.split(':')[0]:<20} {single_legacy:8.0f} -> {single_routed:8.0f} нс")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,203 @@
+# Нагрузочный тест всего бота: синтетические апдейты идут через dp.feed_update, как при webhook,
+# а вместо Telegram отвечает локальный фейковый Bot API с заготовленными ответами.
+# Нужен локальный Postgres (одноразовая база: бот создаст схему и запишет туда тестовых пользователей и жалобы).
+# С BENCH_RESET=1 данные прошлых запусков стираются перед замером - тогда прогоны сравнимы между собой.
+# Сценарии: /start, подача жалобы (кнопка -> причина -> цель) и пагинация админ-панели.
+# Считает апдейты/сек, p50/p99 задержки по шагам и среднее число запросов к БД на апдейт.
+# Запуск: BENCH_RESET=1 BENCH_DATABASE_URL=postgresql://localhost/bench python bench/bench_load.py [пользователей] [одновременно]
+import asyncio
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from aiogram import types
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from botmodule import load_bot
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+API_LATENCY = float(os.getenv("BENCH_API_LATENCY", "0")) # Искусственная задержка фейкового Bot API (секунды)
+ADMIN_PAGES = int(os.getenv("BENCH_ADMIN_PAGES", "5")) # Сколько страниц жалоб пролистывает админ
+USER_ID_BASE = 7_000_000_000 # Тестовые пользователи не пересекаются с настоящими id
+BENCH_RESET = os.getenv("BENCH_RESET", "0") == "1" # Очистить таблицы бота перед замером
+
+bot_module = load_bot(
+    DATABASE_URL=os.getenv("BENCH_DATABASE_URL", "postgresql://localhost/bench"),
+    # Лимиты отправки и жалоб выкручены, чтобы мерить сам бот, а не ограничители
+    OUTBOUND_GLOBAL_RATE="1000000",
+    OUTBOUND_CHAT_RATE="1000000",
+    OUTBOUND_CHAT_BURST="1000000",
+    REPORT_LIMIT="1000000",
+    START_REPORT_LIMIT="1000000",
+    MAX_PENDING_UPDATES="1000000",
+    METRICS_PORT="0",
+)
+ADMIN_ID = bot_module.ADMIN_ID
+logging.getLogger().setLevel(logging.WARNING) # Строка лога на каждый апдейт исказила бы замер
+
+# --- ФЕЙКОВЫЙ BOT API ---
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {} # метод -> количество вызовов
+        self.markups = {} # chat_id -> последняя отправленная клавиатура
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = dict(await request.post()) if request.can_read_body else {}
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+        if "reply_markup" in params and chat_id is not None:
+            self.markups[chat_id] = json.loads(params["reply_markup"])
+
+        if method in ("sendMessage", "editMessageText"):
+            message_id = int(params["message_id"]) if "message_id" in params else next(self._message_ids)
+            result = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        else: # answerCallbackQuery, pinChatMessage, deleteMessage и прочие
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def next_page_data(self, chat_id: int) -> str | None:
+        # callback_data кнопки "▶️" из последней клавиатуры - так админ листает дальше
+        for row in self.markups.get(chat_id, {}).get("inline_keyboard", []):
+            for button in row:
+                if button.get("text") == "▶️":
+                    return button["callback_data"]
+        return None
+
+async def start_fake_api(api: FakeBotAPI) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    bot_module.bot.session.api = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+    return runner
+
+# --- СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ---
+update_ids = itertools.count(1)
+
+def user_payload(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Bench{user_id}", "username": f"bench_{user_id}"}
+
+def message_update(user_id: int, text: str) -> dict:
+    update_id = next(update_ids)
+    return {"update_id": update_id, "message": {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user_payload(user_id),
+        "text": text,
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else [],
+    }}
+
+def callback_update(user_id: int, data: str) -> dict:
+    update_id = next(update_ids)
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id),
+        "chat_instance": str(user_id),
+        "from": user_payload(user_id),
+        "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "text": "bench"},
+    }}
+
+latencies = {} # шаг сценария -> список задержек (секунды)
+
+async def feed(step: str, raw: dict):
+    update = types.Update.model_validate(raw, context={"bot": bot_module.bot})
+    start = time.perf_counter()
+    await bot_module.dp.feed_update(bot_module.bot, update)
+    latencies.setdefault(step, []).append(time.perf_counter() - start)
+
+async def user_scenario(user_id: int):
+    await feed("start", message_update(user_id, "/start"))
+    await feed("start_report", callback_update(user_id, "start_report"))
+    await feed("report_preset", callback_update(user_id, "report_preset:Спам"))
+    await feed("report_target", message_update(user_id, f"@bench_target_{user_id}"))
+
+async def admin_scenario(api: FakeBotAPI):
+    await feed("admin_panel", callback_update(ADMIN_ID, "admin_panel"))
+    await feed("admin_reports", callback_update(ADMIN_ID, "admin_reports:0"))
+    for _ in range(ADMIN_PAGES):
+        data = api.next_page_data(ADMIN_ID)
+        if data is None:
+            break
+        await feed("admin_reports_page", callback_update(ADMIN_ID, data))
+    await feed("admin_users", callback_update(ADMIN_ID, "admin_users:0"))
+
+async def reset_bench_data():
+    # Одинаковое стартовое состояние: глубина пагинации, счётчики и планы запросов не зависят от прошлых запусков.
+    # TRUNCATE не вызывает построчные триггеры, поэтому счётчики обнуляем вручную.
+    async with bot_module.db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute('''
+                TRUNCATE reports, reports_archive, users, fsm_states, rate_limits,
+                         report_stats, report_resolution_stats RESTART IDENTITY;
+                UPDATE counters SET value = 0;
+                ANALYZE;
+            ''')
+    bot_module.user_cache.clear()
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+async def main():
+    api = FakeBotAPI(API_LATENCY)
+    runner = await start_fake_api(api)
+    await bot_module.init_db()
+    if BENCH_RESET:
+        await reset_bench_data()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    # Без сброса нужны новые id на каждый запуск, иначе сработает дедупликация жалоб
+    run_id = 0 if BENCH_RESET else int(time.time()) % 1_000_000 * 1000
+
+    async def limited(coro):
+        async with semaphore:
+            await coro
+
+    try:
+        bot_module.update_stats.update(updates=0, queries=0)
+        start = time.perf_counter()
+        tasks = [limited(user_scenario(USER_ID_BASE + run_id + i)) for i in range(USERS)]
+        # Админ листает жалобы параллельно с потоком пользователей
+        tasks.append(admin_scenario(api))
+        await asyncio.gather(*tasks)
+        if bot_module.background_tasks: # Уведомления админу тоже часть нагрузки
+            await asyncio.gather(*bot_module.background_tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - start
+
+        all_latencies = [value for values in latencies.values() for value in values]
+        print(f"Пользователей: {USERS}, одновременно: {CONCURRENCY}, задержка API: {API_LATENCY * 1000:.0f} мс")
+        print(f"Апдейтов: {len(all_latencies)} за {elapsed:.2f} с = {len(all_latencies) / elapsed:.0f} апдейтов/с")
+        print(f"Задержка: p50 {percentile(all_latencies, 0.5) * 1000:.1f} мс, p99 {percentile(all_latencies, 0.99) * 1000:.1f} мс")
+        print(f"Запросов к БД на апдейт: {bot_module.queries_per_update():.2f}")
+        print(f"Вызовов Bot API: {sum(api.calls.values())} ({', '.join(f'{m} {n}' for m, n in sorted(api.calls.items()))})")
+        for step, values in latencies.items():
+            print(f"  {step:<20} n={len(values):<6} p50 {statistics.median(values) * 1000:7.1f} мс  p99 {percentile(values, 0.99) * 1000:7.1f} мс")
+    finally:
+        await bot_module.flush_registrations()
+        await bot_module.db_pool.close()
+        await bot_module.bot.session.close()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+# Микро-бенчмарк: сколько стоит отрисовка клавиатур и текстов на один ответ.
+# Клавиатуры: сборка через InlineKeyboardBuilder на каждый вызов (build_*/__wrapped__ - без кэша) против готовых.
+# Тексты: прежняя f-строка прямо в обработчике против шаблонов render_* (цена - один вызов функции).
+# Считает время и оставшуюся выделенной память (tracemalloc) на отрисовку.
+# Запуск: python bench/bench_render.py [итераций]
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from botmodule import load_bot
+
+bot_module = load_bot()
+
+REPORT_IDS = range(1, 101) # Админ листает одни и те же жалобы - так работает кэш с ограничением размера
+NOW = datetime(2026, 1, 2, 3, 4, 5)
+
+CASES = [
+    ("welcome_kb", lambda i: bot_module.build_welcome_kb(True), lambda i: bot_module.get_welcome_kb(True)),
+    ("report_options_kb", lambda i: bot_module.build_report_options_kb(), lambda i: bot_module.get_report_options_kb()),
+    ("admin_panel_kb", lambda i: bot_module.build_admin_panel_kb(), lambda i: bot_module.get_admin_panel_kb()),
+    ("report_sent_kb", lambda i: bot_module.get_report_sent_kb.__wrapped__("admin"), lambda i: bot_module.get_report_sent_kb("admin")),
+    ("report_actions_kb",
+     lambda i: bot_module.get_report_actions_kb.__wrapped__(REPORT_IDS[i % len(REPORT_IDS)]),
+     lambda i: bot_module.get_report_actions_kb(REPORT_IDS[i % len(REPORT_IDS)])),
+    ("user_profile_kb",
+     lambda i: bot_module.get_user_profile_kb.__wrapped__(REPORT_IDS[i % len(REPORT_IDS)], False),
+     lambda i: bot_module.get_user_profile_kb(REPORT_IDS[i % len(REPORT_IDS)], False)),
+    ("report_card_text",
+     lambda i, reason="Спам", sender_id=42, sender="@sender", target="@target": (
+         f"№{i} жалоба\nПричина: {reason}\nID отправителя: {sender_id}\nUsername отправителя: {sender}\n"
+         f"ID/Username на кого подана жалоба: {target}\nСтатус: 🟡 Ждет одобрения..."),
+     lambda i: bot_module.render_report_card(report_id=i, reason="Спам", sender_id=42, sender_mention="@sender",
+                                             target_mention="@target", status=bot_module.STATUS_PENDING_TEXT)),
+    ("admin_new_report_text",
+     lambda i, reason="Спам", sender="@sender", target="@target": (
+         f"📩 **Новая жалоба!**\n**Данные:**\n👤 Username: {sender}\n🆔 ID: {i}\n📄 Текст жалобы: {reason}\n"
+         f"🎯 На цель: {target}\n⏳ Время жалобы: {NOW.strftime('%d.%m.%Y | %H:%M:%S')}"),
+     lambda i: bot_module.render_admin_new_report(sender_mention="@sender", sender_id=i, reason="Спам",
+                                                  target_mention="@target", report_time=NOW)),
+]
+
+def measure_time(render, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        render(i)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+def measure_alloc(render, iterations: int) -> float:
+    # Сколько байт остаётся выделено на одну отрисовку (результаты держим, чтобы они попали в снимок)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [render(i) for i in range(iterations)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    del kept
+    return size / iterations
+
+def main(iterations: int):
+    for _, built, cached in CASES: # Прогрев (и заполнение кэшей)
+        measure_time(built, iterations // 10)
+        measure_time(cached, iterations // 10)
+    print(f"{'':<24}{'было, нс':>12}{'стало, нс':>10}{'':>9}{'было, Б':>12}{'стало, Б':>9}")
+    for name, built, cached in CASES:
+        built_ns = measure_time(built, iterations)
+        cached_ns = measure_time(cached, iterations)
+        built_bytes = measure_alloc(built, iterations // 10)
+        cached_bytes = measure_alloc(cached, iterations // 10)
+        print(f"{name:<24}{built_ns:12.0f}{cached_ns:10.0f}{built_ns / cached_ns:8.1f}x{built_bytes:12.0f}{cached_bytes:9.0f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
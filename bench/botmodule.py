@@ -0,0 +1,19 @@
+# Загрузка "code (3).py" как модуля для бенчмарков: имя файла не импортируется обычным import,
+# а на уровне модуля бот требует токен и DATABASE_URL - подставляем фиктивные значения.
+import importlib.util
+import os
+import sys
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code (3).py")
+TOKEN_ENV = "8336714025:AAFF028y4ae3n-0ul4y8DIZpvj69KffjKIU" # Так бот читает токен (см. TOKEN в боте)
+
+def load_bot(**env):
+    os.environ.setdefault(TOKEN_ENV, "123456:BENCHMARK")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ.setdefault("DATABASE_URL", "postgresql://localhost/bench")
+    os.environ.update(env)
+    spec = importlib.util.spec_from_file_location("donos_bot", BOT_FILE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["donos_bot"] = module
+    spec.loader.exec_module(module)
+    return module
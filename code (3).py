@@ -1,19 +1,40 @@
 
 import asyncio
+import atexit
+import gzip
 import logging
+import logging.handlers
 import os
+import queue
+import signal
+import sys
+import tempfile
 from datetime import datetime, timedelta
 import asyncpg # Для работы с PostgreSQL
 import time # Для генерации report_id
+import hashlib
+import itertools
+import json
+from bisect import bisect_left
+from collections import OrderedDict, deque # Для LRU-кэша пользователей
+from functools import lru_cache
+from html import escape # Пользовательский текст в сообщениях с parse_mode="HTML"
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
 from aiogram.filters import CommandStart
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
-from aiogram.exceptions import TelegramBadRequest # Для обработки ошибок закрепления
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter # Для обработки ошибок закрепления и флуд-контроля
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application # Для режима webhook
+from aiohttp import web
 
 # --- КОНФИГУРАЦИЯ ---
 # На Railway в Variables добавь BOT_TOKEN, ADMIN_ID, DATABASE_URL
@@ -23,8 +44,160 @@ ADMIN_USERNAME = "aggentov" # Имя пользователя админа бе
 ADMIN_ID_STR = os.getenv("ADMIN_ID")
 ADMIN_ID = int(ADMIN_ID_STR) if ADMIN_ID_STR else None # ID админа для личных уведомлений (должен быть числом!)
 DATABASE_URL = os.getenv("DATABASE_URL") # URL базы данных PostgreSQL
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000")) # Максимум пользователей в кэше
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300")) # Время жизни записи в кэше (секунды); столько могут отставать username/first_name/total_reports в других процессах
+USER_CACHE_LISTEN = os.getenv("USER_CACHE_LISTEN", "1") == "1" # Слушать бан/разбан из других процессов бота (LISTEN/NOTIFY); 0 - один процесс
+USER_CACHE_LISTEN_PING = float(os.getenv("USER_CACHE_LISTEN_PING", "30")) # Как часто проверять соединение LISTEN (секунды)
+REGISTRATION_FLUSH_INTERVAL = float(os.getenv("REGISTRATION_FLUSH_INTERVAL", "5")) # Как часто сбрасывать изменения профилей в БД (секунды)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25")) # Сообщений в секунду на весь бот (лимит Telegram ~30)
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1")) # Сообщений в секунду в один чат
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3")) # Сколько сообщений в один чат можно отправить подряд
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "5")) # Повторов после TelegramRetryAfter
+OUTBOUND_GLOBAL_BACKOFF_CHATS = int(os.getenv("OUTBOUND_GLOBAL_BACKOFF_CHATS", "3")) # С скольких разных чатов с 429 за окно притормаживать всю отправку
+OUTBOUND_GLOBAL_BACKOFF_WINDOW = float(os.getenv("OUTBOUND_GLOBAL_BACKOFF_WINDOW", "10")) # Окно подсчёта таких чатов (секунды)
+BULK_NOTIFY_MAX_IDS = int(os.getenv("BULK_NOTIFY_MAX_IDS", "30")) # Сколько номеров жалоб перечислять в одном уведомлении при массовом решении
+ADMIN_DIGEST_THRESHOLD = int(os.getenv("ADMIN_DIGEST_THRESHOLD", "10")) # Больше N жалоб за интервал - админу уходит сводка, а не по сообщению; 0 - всегда по одной
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "60")) # Окно подсчёта и период отправки сводок (секунды)
+ADMIN_DIGEST_MAX_IDS = int(os.getenv("ADMIN_DIGEST_MAX_IDS", "10")) # Сколько последних номеров жалоб показывать в сводке
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0") # Адрес, на котором слушает веб-сервер
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080"))) # Railway отдаёт порт в PORT
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") # Публичный адрес бота (без пути); если не задан, webhook в Telegram не регистрируется
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+
+# Пул соединений к PostgreSQL
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2")) # Столько соединений открывается (и прогревается) при старте
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")) # Кэш подготовленных запросов asyncpg на соединение
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "10")) # Секунды
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300")) # Через сколько секунд простоя закрывать соединение
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "50")) # Сколько апдейтов обрабатывается одновременно
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "200")) # Сколько может ждать своей очереди, остальные отбрасываются
+BUSY_REPLY_INTERVAL = float(os.getenv("BUSY_REPLY_INTERVAL", "30")) # Не чаще одного сообщения "занято" в чат за столько секунд
+BUSY_REPLY_MAX_DEPTH = int(os.getenv("BUSY_REPLY_MAX_DEPTH", "100")) # При такой очереди отправки сообщения "занято" не шлются совсем
+
+# Лимиты на жалобы от одного отправителя: не больше N за период (секунды)
+REPORT_LIMIT = int(os.getenv("REPORT_LIMIT", "5"))
+REPORT_LIMIT_PERIOD = float(os.getenv("REPORT_LIMIT_PERIOD", "3600"))
+START_REPORT_LIMIT = int(os.getenv("START_REPORT_LIMIT", "20")) # Нажатий "Отправить донос"
+START_REPORT_LIMIT_PERIOD = float(os.getenv("START_REPORT_LIMIT_PERIOD", "60"))
+REPORT_DEDUP_WINDOW = float(os.getenv("REPORT_DEDUP_WINDOW", "86400")) # Одинаковые жалобы в пределах окна (секунды) не дублируются; 0 - выключено
+REPORT_ARCHIVE_AFTER_DAYS = float(os.getenv("REPORT_ARCHIVE_AFTER_DAYS", "30")) # Решённые жалобы старше N дней уходят в архив; 0 - не архивировать
+REPORT_ARCHIVE_BATCH = int(os.getenv("REPORT_ARCHIVE_BATCH", "1000")) # Сколько жалоб переносить за одну транзакцию
+REPORT_ARCHIVE_INTERVAL = float(os.getenv("REPORT_ARCHIVE_INTERVAL", "3600")) # Как часто запускать архивацию (секунды)
+RATE_LIMIT_PERSIST = os.getenv("RATE_LIMIT_PERSIST", "").lower() in ("1", "true", "yes") # Сохранять лимиты в БД между рестартами
+RATE_LIMIT_FLUSH_INTERVAL = float(os.getenv("RATE_LIMIT_FLUSH_INTERVAL", "30")) # Как часто сохранять лимиты в БД (секунды)
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres").lower() # "postgres" (общее для всех процессов) или "memory"
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400")) # Через сколько секунд без изменений состояние считается брошенным
+FSM_CLEANUP_INTERVAL = float(os.getenv("FSM_CLEANUP_INTERVAL", "600")) # Как часто чистить брошенные состояния (секунды)
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "1024")) # Сколько клавиатур с параметрами (жалоба/профиль) держать готовыми
+STATS_DAYS = int(os.getenv("STATS_DAYS", "7")) # За сколько последних дней показывать статистику в админ-панели
+EXPORT_DIR = os.getenv("EXPORT_DIR", tempfile.gettempdir()) # Куда писать временные файлы выгрузки
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(1024 * 1024))) # Сколько байт CSV копить перед сжатием и записью
+EXPORT_MAX_UPLOAD = 50 * 1024 * 1024 # Лимит Bot API на отправку документа
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1") # Метрики Prometheus отдаются только локально
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108")) # 0 - не поднимать эндпоинт /metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower() # "json" (одна запись - одна строка JSON) или "text"
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "5")) # Сколько одинаковых предупреждений за окно пишется целиком
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100")) # Сверх этого - каждое N-е; 0 - не прореживать
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "60")) # Окно подсчёта повторов (секунды)
+
+# --- ЛОГИРОВАНИЕ ---
+# Обработчики только кладут запись в очередь (QueueHandler), форматирование и запись в stdout
+# идут в отдельном потоке (QueueListener) - медленный stdout не тормозит event loop.
+# Контекст апдейта (update_id, user_id, обработчик) берётся из log_context и попадает в каждую запись.
+log_context = ContextVar("log_context", default=None)
+LOG_CONTEXT_FIELDS = ("update_id", "user_id", "handler", "latency_ms")
+
+class LogContextFilter(logging.Filter):
+    # Выполняется в потоке, который пишет лог, - там, где виден контекст текущего апдейта
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = log_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+class LogSamplingFilter(logging.Filter):
+    # Повторяющиеся предупреждения (ключ - место в коде) за окно: первые burst пишутся, дальше каждое every-е.
+    # Ошибки не прореживаются.
+    def __init__(self, burst: int, every: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.window = window
+        self._seen = {} # (файл, строка) -> [начало окна, количество]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every <= 0 or record.levelno != logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        seen = self._seen.get(key)
+        if seen is None or now - seen[0] >= self.window:
+            if len(self._seen) > 10000:
+                self._seen.clear()
+            seen = self._seen[key] = [now, 0]
+        seen[1] += 1
+        if seen[1] <= self.burst:
+            return True
+        if (seen[1] - self.burst) % self.every:
+            return False
+        record.sampled = self.every # Эта запись представляет every похожих
+        return True
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    # Стандартный QueueHandler склеивает сообщение с аргументами и traceback прямо в потоке event loop
+    # (ради pickle). Очередь у нас в памяти процесса, так что запись уходит как есть: msg % args
+    # и traceback форматирует поток QueueListener, а отброшенные фильтрами записи не форматируются вовсе.
+    # Поэтому в горячих местах логируем с %-аргументами, а не f-строкой.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in LOG_CONTEXT_FIELDS + ("sampled",):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging() -> logging.handlers.QueueListener:
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(LogSamplingFilter(LOG_SAMPLE_BURST, LOG_SAMPLE_EVERY, LOG_SAMPLE_WINDOW))
+    queue_handler.addFilter(LogContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING) # "Update is handled" пишет HandlerMetricsMiddleware, с контекстом
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # Дописываем очередь при выходе
+    return listener
+
+log_listener = setup_logging()
 
 if not TOKEN:
     logging.error("Ошибка: Переменная BOT_TOKEN не установлена!")
@@ -35,9 +208,48 @@ if not DATABASE_URL:
     logging.error("Ошибка: Переменная DATABASE_URL не установлена!")
     exit("Ошибка: Переменная DATABASE_URL не установлена!")
 
+# --- ХРАНИЛИЩЕ FSM ---
+# Состояния FSM в таблице fsm_states на общем db_pool: переживают рестарт и видны всем процессам бота.
+# Одна строка на ключ, запись - upsert, сброс - удаление опустевшей строки; брошенные строки удаляет cleanup_fsm_states.
+class PostgresStorage(BaseStorage):
+    def __init__(self):
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            async with db_acquire("fsm_clear_state") as conn:
+                await conn.prepared["fsm_clear_state"].execute(self.key_builder.build(key))
+            return
+        async with db_acquire("fsm_set_state") as conn:
+            await conn.prepared["fsm_set_state"].execute(self.key_builder.build(key), state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        async with db_acquire("fsm_get_state") as conn:
+            return await conn.prepared["fsm_get_state"].fetchval(self.key_builder.build(key))
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        if not data:
+            async with db_acquire("fsm_clear_data") as conn:
+                await conn.prepared["fsm_clear_data"].execute(self.key_builder.build(key))
+            return
+        async with db_acquire("fsm_set_data") as conn:
+            await conn.prepared["fsm_set_data"].execute(self.key_builder.build(key), json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        async with db_acquire("fsm_get_data") as conn:
+            data = await conn.prepared["fsm_get_data"].fetchval(self.key_builder.build(key))
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        pass # Пул закрывается вместе с ботом
+
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
+# FSM-мидлварь (dp.fsm) регистрируется вручную после ограничителя нагрузки: отброшенный апдейт не читает состояние из БД
+dp = Dispatcher(storage=PostgresStorage() if FSM_STORAGE == "postgres" else MemoryStorage(), disable_fsm=True)
 db_pool = None # Пул соединений к БД
+pending_registrations = {} # user_id -> (username, first_name), ждут записи в БД
+background_tasks = set() # Фоновые задачи (уведомления и т.п.), держим ссылки, чтобы их не собрал GC
 
 # --- СОСТОЯНИЯ ДЛЯ FSM ---
 class ReportStates(StatesGroup):
@@ -46,113 +258,1444 @@ class ReportStates(StatesGroup):
     # Состояние для ввода ID/Username цели жалобы
     waiting_for_target = State()
 
+class AdminStates(StatesGroup):
+    # Состояние для ввода поискового запроса в админ-панели
+    waiting_for_search = State()
+
+# --- КЭШ ПОЛЬЗОВАТЕЛЕЙ ---
+# LRU-кэш строк из users с TTL, чтобы проверка на бан не ходила в БД на каждый апдейт.
+# Все записи в users идут через хэлперы ниже, и они сами обновляют кэш. Бан и разбан ещё и
+# рассылаются через NOTIFY USER_CACHE_CHANNEL: другие процессы бота сбрасывают у себя запись
+# (user_cache_listen_loop), так что бан действует везде сразу, а не через USER_CACHE_TTL.
+# Остальные поля в чужих процессах могут отставать до USER_CACHE_TTL.
+USER_CACHE_CHANNEL = "user_cache" # payload - user_id
+class UserCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict() # user_id -> (время записи, dict с данными или None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        # Возвращает (найдено, данные). None в данных означает "пользователя нет в БД"
+        entry = self._data.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._data[user_id]
+            self.misses += 1
+            return False, None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, user_id: int, user_data: dict | None):
+        self._data[user_id] = (time.monotonic(), user_data)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def update(self, user_id: int, **fields):
+        # Обновляем поля уже закэшированного пользователя; если его нет - просто забываем
+        entry = self._data.get(user_id)
+        if entry is None or entry[1] is None:
+            self.invalidate(user_id)
+            return
+        entry[1].update(fields)
+
+    def invalidate(self, user_id: int):
+        self._data.pop(user_id, None)
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return f"{len(self._data)}/{self.max_size} записей, попаданий {self.hit_rate:.1%} ({self.hits}/{self.hits + self.misses})"
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# --- ИСХОДЯЩИЕ СООБЩЕНИЯ ---
+PRIORITY_INTERACTIVE = 0 # Ответы пользователю, который сейчас нажимает кнопки
+PRIORITY_BACKGROUND = 1 # Уведомления (админу, об одобрении, о бане и т.п.)
+outbound_priority = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0 # После RetryAfter чат/бот молчит до этого момента
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        # Сколько секунд ждать до следующего токена (0 - можно прямо сейчас)
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+# Все запросы к Bot API с chat_id проходят через эту очередь: общий и поканальный лимит,
+# приоритет интерактивных ответов над уведомлениями и повтор после TelegramRetryAfter.
+# Поканальный лимит Telegram - на новые сообщения, поэтому токен чата тратят только send*/forward*/copy*.
+# Правки, закрепления и удаления (листание админ-панели) идут по общему лимиту и ждут чат только после 429.
+CHAT_LIMITED_PREFIXES = ("send", "forward", "copy")
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int,
+                 backoff_chats: int, backoff_window: float, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.backoff_chats = backoff_chats
+        self.backoff_window = backoff_window
+        self._retry_chats = OrderedDict() # chat_id -> время последнего 429, от старых к новым
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = OrderedDict() # chat_id -> TokenBucket
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count() # Сохраняет порядок внутри одного приоритета
+        self._delayed = 0 # Ждут своей очереди в чате (отложены через call_later)
+        self._in_flight = 0
+        self._worker = None
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None: # answerCallbackQuery, setWebhook и т.п. не расходуют лимит сообщений
+            return await make_request(bot, method)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        chat_limited = getattr(method, "__api_method__", "").startswith(CHAT_LIMITED_PREFIXES)
+        self._queue.put_nowait((outbound_priority.get(), next(self._seq), chat_id, lambda: make_request(bot, method), future, 0, chat_limited))
+        return await future
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() + self._delayed + self._in_flight
+
+    def stats(self) -> str:
+        return f"в очереди {self._queue.qsize()}, ждут чат {self._delayed}, отправляется {self._in_flight}"
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _note_retry(self, chat_id, now: float) -> int:
+        # Сколько разных чатов получили 429 за последние backoff_window секунд (вместе с этим)
+        self._retry_chats[chat_id] = now
+        self._retry_chats.move_to_end(chat_id)
+        while next(iter(self._retry_chats.values())) < now - self.backoff_window:
+            self._retry_chats.popitem(last=False)
+        return len(self._retry_chats)
+
+    def _requeue(self, item):
+        self._delayed -= 1
+        self._queue.put_nowait(item)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            chat_id, future, chat_limited = item[2], item[4], item[6]
+            if future.done(): # Ожидающий уже отменён
+                continue
+            now = time.monotonic()
+            chat_bucket = self._chat_bucket(chat_id)
+            chat_wait = chat_bucket.delay(now) if chat_limited else chat_bucket.blocked_until - now
+            if chat_wait > 0:
+                # Этот чат пока нельзя трогать - откладываем, не задерживая остальные чаты
+                self._delayed += 1
+                loop.call_later(chat_wait, self._requeue, item)
+                continue
+            global_wait = self.global_bucket.delay(now)
+            if global_wait > 0:
+                # Возвращаем в очередь: за время ожидания может прийти что-то приоритетнее
+                self._queue.put_nowait(item)
+                await asyncio.sleep(global_wait)
+                continue
+            self.global_bucket.take()
+            if chat_limited:
+                chat_bucket.take()
+            self._in_flight += 1
+            asyncio.create_task(self._deliver(item))
+
+    async def _deliver(self, item):
+        priority, seq, chat_id, make_request, future, attempt, chat_limited = item
+        try:
+            result = await make_request()
+        except TelegramRetryAfter as e:
+            if attempt >= self.max_retries or future.done():
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Обычно 429 - про один чат: молчит только он (сколько просит Telegram, при повторах - с нарастающим
+            # запасом), остальные чаты идут дальше. Если 429 сразу в нескольких чатах - упёрлись в общий лимит бота.
+            now = time.monotonic()
+            self._chat_bucket(chat_id).block(now, e.retry_after + 2 ** attempt - 1)
+            retry_chats = self._note_retry(chat_id, now)
+            if retry_chats >= self.backoff_chats:
+                self.global_bucket.block(now, e.retry_after)
+                logging.warning("Флуд-контроль в %s чатах за %s с, вся отправка ждёт %s с", retry_chats, self.backoff_window, e.retry_after)
+            logging.warning("Флуд-контроль в чате %s, повтор через %s с (попытка %s)", chat_id, e.retry_after, attempt + 1)
+            self._queue.put_nowait((priority, seq, chat_id, make_request, future, attempt + 1, chat_limited))
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._in_flight -= 1
+
+outbound = OutboundScheduler(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES,
+                             OUTBOUND_GLOBAL_BACKOFF_CHATS, OUTBOUND_GLOBAL_BACKOFF_WINDOW)
+bot.session.middleware(outbound)
+
+# --- ЛИМИТЫ НА ЖАЛОБЫ ---
+# Token bucket на каждого отправителя, целиком в памяти: проверка не ходит в БД.
+# При RATE_LIMIT_PERSIST состояние периодически сохраняется в rate_limits и поднимается при старте.
+class SenderRateLimiter:
+    def __init__(self, name: str, limit: int, period: float, max_senders: int = 100000):
+        self.name = name
+        self.rate = limit / period
+        self.capacity = limit
+        self.period = period
+        self.max_senders = max_senders
+        self._buckets = OrderedDict() # sender_id -> TokenBucket
+        self._dirty = set() # Изменились с последнего сохранения
+
+    def _bucket(self, sender_id: int, tokens: float | None = None) -> TokenBucket:
+        bucket = self._buckets.get(sender_id)
+        if bucket is None:
+            bucket = self._buckets[sender_id] = TokenBucket(self.rate, self.capacity)
+            while len(self._buckets) > self.max_senders:
+                self._buckets.popitem(last=False)
+        if tokens is not None:
+            bucket.tokens = tokens
+        self._buckets.move_to_end(sender_id)
+        return bucket
+
+    def retry_after(self, sender_id: int) -> float:
+        # Через сколько секунд у отправителя появится попытка (0 - можно сейчас), без списания
+        return self._bucket(sender_id).delay(time.monotonic())
+
+    def acquire(self, sender_id: int) -> float:
+        # Списывает попытку, если она есть; иначе возвращает, сколько ждать
+        wait = self.retry_after(sender_id)
+        if wait <= 0:
+            self._buckets[sender_id].take()
+            self._dirty.add(sender_id)
+        return wait
+
+    async def load(self):
+        async with db_acquire("rate_limits_load") as conn:
+            rows = await conn.fetch('''
+                SELECT sender_id, tokens, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - updated_at) AS age
+                FROM rate_limits WHERE name = $1 AND updated_at > CURRENT_TIMESTAMP - $2 * INTERVAL '1 second'
+            ''', self.name, self.period)
+        for row in rows:
+            self._bucket(row['sender_id'], min(self.capacity, row['tokens'] + float(row['age']) * self.rate))
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        now = time.monotonic()
+        sender_ids = [sender_id for sender_id in self._dirty if sender_id in self._buckets]
+        self._dirty.clear()
+        tokens = []
+        for sender_id in sender_ids:
+            bucket = self._buckets[sender_id]
+            bucket.delay(now) # Досчитываем пополнение на текущий момент
+            tokens.append(bucket.tokens)
+        try:
+            async with db_acquire("rate_limits_flush") as conn:
+                # За period ведро наполняется целиком - такие строки при загрузке не нужны, удаляем
+                await conn.execute('''
+                    DELETE FROM rate_limits WHERE name = $1 AND updated_at < CURRENT_TIMESTAMP - $2 * INTERVAL '1 second'
+                ''', self.name, self.period)
+                await conn.execute('''
+                    INSERT INTO rate_limits (name, sender_id, tokens, updated_at)
+                    SELECT $1::TEXT, u.sender_id, u.tokens, CURRENT_TIMESTAMP
+                    FROM unnest($2::BIGINT[], $3::DOUBLE PRECISION[]) AS u(sender_id, tokens)
+                    ON CONFLICT (name, sender_id) DO UPDATE SET tokens = EXCLUDED.tokens, updated_at = EXCLUDED.updated_at;
+                ''', self.name, sender_ids, tokens)
+        except Exception as e:
+            logging.error("Не удалось сохранить лимиты %s: %s", self.name, e)
+            self._dirty.update(sender_ids)
+
+report_limiter = SenderRateLimiter("report", REPORT_LIMIT, REPORT_LIMIT_PERIOD)
+start_report_limiter = SenderRateLimiter("start_report", START_REPORT_LIMIT, START_REPORT_LIMIT_PERIOD)
+rate_limiters = (report_limiter, start_report_limiter)
+
+def format_wait(seconds: float) -> str:
+    return f"{int(seconds // 60) + 1} мин." if seconds >= 60 else f"{int(seconds) + 1} с."
+
+async def rate_limit_flush_loop():
+    while True:
+        await asyncio.sleep(RATE_LIMIT_FLUSH_INTERVAL)
+        for limiter in rate_limiters:
+            await limiter.flush()
+
+# --- ОГРАНИЧЕНИЕ НАГРУЗКИ ---
+# Не больше MAX_CONCURRENT_UPDATES обработчиков одновременно (пул БД и Bot API не резиновые)
+# и не больше MAX_PENDING_UPDATES в ожидании. Сверх этого апдейт отбрасывается: кнопке всегда отвечаем
+# всплывашкой (answerCallbackQuery не идёт через очередь отправки), а сообщение "занято" шлём не чаще
+# раза в BUSY_REPLY_INTERVAL на чат и только пока очередь отправки не забита - иначе отброшенная
+# нагрузка просто переехала бы в очередь отправки.
+BUSY_TEXT = "⏳ Бот перегружен, попробуйте через минуту."
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    def __init__(self, max_concurrent: int, max_pending: int):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.active = 0
+        self.pending = 0
+        self.shed = 0
+        self.avg_wait = 0.0 # Скользящее среднее ожидания (секунды)
+        self.max_wait = 0.0
+        self._busy_replied = OrderedDict() # chat_id -> когда отправили "занято", от старых к новым
+
+    async def __call__(self, handler, event, data):
+        if self.semaphore.locked() and self.pending >= self.max_pending:
+            self.shed += 1
+            logging.warning("Перегрузка: апдейт %s отброшен (ждут %s, в работе %s)", event.update_id, self.pending, self.active)
+            if event.callback_query:
+                await self._answer_busy(event)
+            elif event.message and self._should_reply_busy(event.message.chat.id, time.monotonic()):
+                run_in_background(self._answer_busy(event))
+            return
+        self.pending += 1
+        start = time.monotonic()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.pending -= 1
+        wait = time.monotonic() - start
+        self.avg_wait = self.avg_wait * 0.9 + wait * 0.1
+        self.max_wait = max(self.max_wait, wait)
+        self.active += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            self.semaphore.release()
+
+    def _should_reply_busy(self, chat_id, now: float) -> bool:
+        if outbound.depth >= BUSY_REPLY_MAX_DEPTH:
+            return False
+        while self._busy_replied and next(iter(self._busy_replied.values())) <= now - BUSY_REPLY_INTERVAL:
+            self._busy_replied.popitem(last=False)
+        if chat_id in self._busy_replied:
+            return False
+        self._busy_replied[chat_id] = now
+        return True
+
+    async def _answer_busy(self, event):
+        # Кнопке хватает всплывашки без сообщения в чат; на текст отвечаем из фона, с низким приоритетом
+        try:
+            if event.callback_query:
+                await event.callback_query.answer(BUSY_TEXT)
+            elif event.message:
+                await event.message.answer(BUSY_TEXT)
+        except Exception as e:
+            logging.error("Не удалось ответить на отброшенный апдейт %s: %s", event.update_id, e)
+
+    def stats(self) -> str:
+        return (f"в работе {self.active}/{self.max_concurrent}, ждут {self.pending}/{self.max_pending}, "
+                f"ожидание {self.avg_wait * 1000:.0f} мс (макс. {self.max_wait * 1000:.0f} мс), отброшено {self.shed}")
+
+update_limiter = ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES)
+dp.update.outer_middleware(update_limiter)
+
+# --- МЕТРИКИ ---
+# Гистограммы задержек и счётчики в текстовом формате Prometheus, без сторонних библиотек.
+# Бакеты не кумулятивные при записи (одно увеличение на наблюдение), суммируются при выдаче.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    # json.dumps экранирует \\ и " так же, как требует формат Prometheus; ensure_ascii=False оставляет кириллицу как есть
+    pairs = [f"{name}={json.dumps(str(value).replace(chr(10), ' '), ensure_ascii=False)}" for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {} # значения меток -> [счётчики по бакетам..., сумма, количество]
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self.series.items():
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, f'le={json.dumps(str(bound))}')} {cumulative}")
+            inf_labels = format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.series.items():
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Gauge:
+    # Значение снимается в момент выдачи метрик - хранить и обновлять его не нужно
+    def __init__(self, name: str, help_text: str, read, metric_type: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.metric_type = metric_type
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}", f"{self.name} {self.read()}"]
+
+handler_seconds = Histogram("bot_handler_seconds", "Время обработки апдейта", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Необработанные исключения в обработчиках", ("handler",))
+db_query_seconds = Histogram("bot_db_query_seconds", "Время работы хэлпера с соединением из пула", ("query",))
+db_query_errors = Counter("bot_db_query_errors_total", "Ошибки запросов к БД", ("query",))
+db_acquire_seconds = Histogram("bot_db_pool_acquire_seconds", "Ожидание свободного соединения в пуле")
+telegram_seconds = Histogram("bot_telegram_request_seconds", "Время запроса к Bot API (без ожидания в очереди отправки)", ("method",))
+telegram_errors = Counter("bot_telegram_errors_total", "Ошибки запросов к Bot API", ("method", "error"))
+
+metrics = [
+    handler_seconds, handler_errors, db_query_seconds, db_query_errors, db_acquire_seconds, telegram_seconds, telegram_errors,
+    Gauge("bot_db_pool_size", "Соединений в пуле", lambda: db_pool.get_size() if db_pool else 0),
+    Gauge("bot_db_pool_idle", "Свободных соединений в пуле", lambda: db_pool.get_idle_size() if db_pool else 0),
+    Gauge("bot_outbound_depth", "Исходящих запросов в очереди отправки", lambda: outbound.depth),
+    Gauge("bot_updates_active", "Апдейтов в обработке", lambda: update_limiter.active),
+    Gauge("bot_updates_pending", "Апдейтов в ожидании обработки", lambda: update_limiter.pending),
+    Gauge("bot_updates_shed_total", "Отброшено апдейтов при перегрузке", lambda: update_limiter.shed, "counter"),
+    Gauge("bot_updates_wait_avg_seconds", "Скользящее среднее ожидания слота обработки", lambda: update_limiter.avg_wait),
+    Gauge("bot_updates_wait_max_seconds", "Максимальное ожидание слота обработки", lambda: update_limiter.max_wait),
+    Gauge("bot_user_cache_hits_total", "Попадания в кэш пользователей", lambda: user_cache.hits, "counter"),
+    Gauge("bot_user_cache_misses_total", "Промахи кэша пользователей", lambda: user_cache.misses, "counter"),
+    Gauge("bot_pending_registrations", "Изменения профилей, ждущие записи в БД", lambda: len(pending_registrations)),
+    Gauge("bot_db_queries_per_update", "Среднее число обращений к БД на апдейт (вместе с FSM)", lambda: queries_per_update()),
+]
+
+def render_metrics() -> str:
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Метка обработчика: префикс callback_data для кнопок, FSM-состояние для сообщений.
+    # Стоит внутри ограничителя нагрузки, так что ожидание своей очереди сюда не входит.
+    async def __call__(self, handler, event, data):
+        if event.callback_query:
+            prefix = (event.callback_query.data or "").partition(":")[0]
+            label = f"callback:{prefix if prefix in CALLBACK_ROUTES else 'unknown'}"
+        elif event.message:
+            label = f"message:{data.get('raw_state') or 'none'}"
+        else:
+            label = event.event_type
+        user = data.get("event_from_user")
+        context = {"update_id": event.update_id, "user_id": user.id if user else None, "handler": label}
+        token = log_context.set(context)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(label)
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            handler_seconds.observe(latency, label)
+            logging.info("Апдейт обработан", extra={"latency_ms": round(latency * 1000, 2)})
+            log_context.reset(token)
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    # Регистрируется после OutboundScheduler, поэтому меряет сам HTTP-запрос, а не очередь
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - start, name)
+
+bot.session.middleware(TelegramMetricsMiddleware())
+
+async def metrics_handler(request: web.Request):
+    return web.Response(body=render_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logging.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
+# --- КОНТЕКСТ АПДЕЙТА ---
+# Счётчик обращений к БД на время обработки одного апдейта. Общая статистика показывает,
+# сколько запросов в среднем стоит апдейт. Экономию дают не повторные чтения из памяти (ни один
+# обработчик не читает одну жалобу дважды, пользователи идут через user_cache), а загрузчики
+# с JOIN: жалоба вместе с отправителем - один запрос вместо двух.
+# Фоновые задачи (run_in_background) в счёт апдейта не входят - апдейт к тому времени уже посчитан.
+class UpdateScope:
+    __slots__ = ("queries",)
+
+    def __init__(self):
+        self.queries = 0
+
+update_scope = ContextVar("update_scope", default=None)
+update_stats = {"updates": 0, "queries": 0}
+
+class UpdateScopeMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        scope = UpdateScope()
+        token = update_scope.set(scope)
+        try:
+            return await handler(event, data)
+        finally:
+            update_scope.reset(token)
+            update_stats["updates"] += 1
+            update_stats["queries"] += scope.queries
+            logging.debug("Апдейт %s: запросов к БД %s", event.update_id, scope.queries)
+
+# Порядок внутри ограничителя нагрузки: контекст апдейта -> FSM (её запросы тоже считаются,
+# а состояние загружается только для апдейтов, получивших слот) -> метрики обработчика (им нужен raw_state)
+dp.update.outer_middleware(UpdateScopeMiddleware())
+dp.update.outer_middleware(dp.fsm)
+dp.update.outer_middleware(HandlerMetricsMiddleware())
+
+def queries_per_update() -> float:
+    return update_stats["queries"] / update_stats["updates"] if update_stats["updates"] else 0.0
+
+@asynccontextmanager
+async def db_acquire(query: str):
+    # Все хэлперы берут соединение отсюда - так считаются обращения к БД в рамках апдейта
+    # и пишутся метрики: ожидание пула и время работы хэлпера (query - его имя)
+    scope = update_scope.get()
+    if scope is not None:
+        scope.queries += 1
+    start = time.perf_counter()
+    async with db_pool.acquire() as conn:
+        acquired = time.perf_counter()
+        db_acquire_seconds.observe(acquired - start)
+        try:
+            yield conn
+        except Exception:
+            db_query_errors.inc(query)
+            raise
+        finally:
+            db_query_seconds.observe(time.perf_counter() - acquired, query)
+
 # --- БАЗА ДАННЫХ ---
+# Горячие запросы готовятся один раз на каждое соединение пула (в init_connection),
+# хэлперы вызывают их по имени через conn.prepared[...].
+# Колонки перечислены явно, без *: подготовленный запрос помнит форму результата, и новая колонка
+# в миграции иначе ломала бы его на уже открытых соединениях (InvalidCachedStatementError).
+USER_COLUMNS = "user_id, username, first_name, reg_date, total_reports, is_banned, ban_message_id"
+REPORT_COLUMNS = "report_id, sender_id, sender_username, reason, target_id, target_username, report_time, status, message_id, dedup_key"
+REPORT_COLUMNS_R = ", ".join(f"r.{column}" for column in REPORT_COLUMNS.split(", ")) # С алиасом r для JOIN
+
+PREPARED_QUERIES = {
+    "get_user_data": f'SELECT {USER_COLUMNS} FROM users WHERE user_id = $1',
+    # При конфликте по dedup_key строка не добавляется и счётчик не растёт - возвращается уже существующая жалоба
+    "add_report": '''
+        WITH new_report AS (
+            INSERT INTO reports (sender_id, sender_username, reason, target_id, target_username, message_id, dedup_key)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (dedup_key) WHERE dedup_key IS NOT NULL DO NOTHING
+            RETURNING report_id, report_time, status
+        ), sender AS (
+            UPDATE users SET total_reports = total_reports + 1
+            WHERE user_id = $1 AND EXISTS (SELECT 1 FROM new_report)
+            RETURNING total_reports
+        )
+        SELECT report_id, report_time, status, (SELECT total_reports FROM sender) AS total_reports, FALSE AS duplicate
+        FROM new_report
+        UNION ALL
+        SELECT report_id, report_time, status, NULL, TRUE
+        FROM reports WHERE dedup_key = $7 AND NOT EXISTS (SELECT 1 FROM new_report)
+    ''',
+    "get_report_by_dedup_key": 'SELECT report_id, report_time, status, NULL AS total_reports, TRUE AS duplicate FROM reports WHERE dedup_key = $1',
+    "get_report_with_sender": f'''
+        SELECT {REPORT_COLUMNS_R}, u.first_name AS sender_first_name
+        FROM reports r LEFT JOIN users u ON u.user_id = r.sender_id
+        WHERE r.report_id = $1
+    ''',
+    "update_report_status": f'''
+        WITH r AS (
+            UPDATE reports SET status = $1 WHERE report_id = $2
+            RETURNING {REPORT_COLUMNS}
+        )
+        SELECT {REPORT_COLUMNS_R}, u.first_name AS sender_first_name
+        FROM r LEFT JOIN users u ON u.user_id = r.sender_id
+    ''',
+    "resolve_reports_by_ids": '''
+        UPDATE reports SET status = $1 WHERE status = 'pending' AND report_id = ANY($2::INT[])
+        RETURNING report_id, sender_id
+    ''',
+    "resolve_reports_by_reason": '''
+        UPDATE reports SET status = $1 WHERE status = 'pending' AND reason = $2
+        RETURNING report_id, sender_id
+    ''',
+    "pending_reasons": '''
+        SELECT reason, COUNT(*) AS total FROM reports WHERE status = 'pending'
+        GROUP BY reason ORDER BY total DESC, reason LIMIT $1
+    ''',
+    "count_pending_by_reason": "SELECT COUNT(*) FROM reports WHERE status = 'pending' AND reason = $1",
+    "pending_reports_first": f'''
+        SELECT {REPORT_COLUMNS} FROM reports WHERE status = 'pending'
+        ORDER BY report_time DESC, report_id DESC LIMIT $1
+    ''',
+    "pending_reports_after": f'''
+        SELECT {REPORT_COLUMNS} FROM reports WHERE status = 'pending' AND (report_time, report_id) < ($2, $3)
+        ORDER BY report_time DESC, report_id DESC LIMIT $1
+    ''',
+    "pending_reports_before": f'''
+        SELECT {REPORT_COLUMNS} FROM reports WHERE status = 'pending' AND (report_time, report_id) > ($2, $3)
+        ORDER BY report_time ASC, report_id ASC LIMIT $1
+    ''',
+    "users_first": f'''
+        SELECT {USER_COLUMNS} FROM users WHERE is_banned = $1
+        ORDER BY reg_date DESC, user_id DESC LIMIT $2
+    ''',
+    "users_after": f'''
+        SELECT {USER_COLUMNS} FROM users WHERE is_banned = $1 AND (reg_date, user_id) < ($3, $4)
+        ORDER BY reg_date DESC, user_id DESC LIMIT $2
+    ''',
+    "users_before": f'''
+        SELECT {USER_COLUMNS} FROM users WHERE is_banned = $1 AND (reg_date, user_id) > ($3, $4)
+        ORDER BY reg_date ASC, user_id ASC LIMIT $2
+    ''',
+    "get_counter": 'SELECT value FROM counters WHERE name = $1',
+    # Экран статистики - один проход по первичным ключам сводных таблиц за последние дни
+    "report_stats": '''
+        SELECT 'count' AS kind, day, reason, status, NULL::INT AS bucket, reports FROM report_stats WHERE day >= $1
+        UNION ALL
+        SELECT 'resolution', day, NULL, NULL, bucket, reports FROM report_resolution_stats WHERE day >= $1
+    ''',
+    # Поиск админа одним запросом: точный id пользователя/жалобы ($1/$2), префикс ($4 - экранированный
+    # шаблон LIKE) или триграммное сходство ($3) по username. Сначала точные, потом префиксы, потом похожие.
+    "admin_search": '''
+        SELECT kind, item_id, username, reason, rank FROM (
+            SELECT 'user' AS kind, user_id AS item_id, username, NULL AS reason, 3.0::REAL AS rank
+            FROM users WHERE user_id = $1
+            UNION ALL
+            SELECT 'report', report_id, sender_username, reason, 3.0::REAL FROM reports WHERE report_id = $2
+            UNION ALL
+            SELECT 'report', report_id, sender_username, reason, 3.0::REAL FROM reports_archive WHERE report_id = $2
+            UNION ALL
+            SELECT 'user', user_id, username, NULL,
+                   CASE WHEN lower(username) LIKE $4 THEN 2.0::REAL ELSE similarity(lower(username), $3) END
+            FROM users WHERE $3 <> '' AND (lower(username) LIKE $4 OR lower(username) % $3)
+            UNION ALL
+            SELECT 'report', report_id, sender_username, reason,
+                   CASE WHEN lower(sender_username) LIKE $4 THEN 2.0::REAL ELSE similarity(lower(sender_username), $3) END
+            FROM reports WHERE $3 <> '' AND (lower(sender_username) LIKE $4 OR lower(sender_username) % $3)
+        ) found
+        ORDER BY rank DESC, kind DESC, item_id DESC
+        LIMIT $5 OFFSET $6
+    ''',
+    "fsm_get_state": 'SELECT state FROM fsm_states WHERE key = $1',
+    "fsm_get_data": 'SELECT data FROM fsm_states WHERE key = $1',
+    "fsm_set_state": '''
+        INSERT INTO fsm_states (key, state) VALUES ($1, $2)
+        ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+    ''',
+    "fsm_set_data": '''
+        INSERT INTO fsm_states (key, data) VALUES ($1, $2::JSONB)
+        ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+    ''',
+    # Сброс (state.clear() = set_state(None) + set_data({})) не вставляет пустых строк: строка, которая
+    # стала бы пустой, удаляется, остальные обновляются. Условия по state/data не пересекаются -
+    # DELETE и UPDATE в одном запросе не трогают одну и ту же строку
+    "fsm_clear_state": '''
+        WITH emptied AS (DELETE FROM fsm_states WHERE key = $1 AND data = '{}'::JSONB)
+        UPDATE fsm_states SET state = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE key = $1 AND data <> '{}'::JSONB AND state IS NOT NULL
+    ''',
+    "fsm_clear_data": '''
+        WITH emptied AS (DELETE FROM fsm_states WHERE key = $1 AND state IS NULL)
+        UPDATE fsm_states SET data = '{}'::JSONB, updated_at = CURRENT_TIMESTAMP
+        WHERE key = $1 AND state IS NOT NULL AND data <> '{}'::JSONB
+    ''',
+}
+
+class BotConnection(asyncpg.Connection):
+    __slots__ = ("prepared",)
+
+async def init_connection(conn: BotConnection):
+    conn.prepared = {name: await conn.prepare(query) for name, query in PREPARED_QUERIES.items()}
+
+# --- МИГРАЦИИ ---
+# Схема меняется только пронумерованными миграциями. Применённые версии записаны в schema_version;
+# при актуальной схеме старт стоит один SELECT. Каждая миграция - в своей транзакции, а весь прогон
+# под advisory lock, так что несколько одновременно стартующих процессов не мешают друг другу.
+MIGRATION_LOCK_ID = 8336714 # Ключ pg_advisory_lock для прогона миграций
+
+async def migration_001_initial(conn):
+    # Таблица пользователей
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            reg_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            total_reports INT DEFAULT 0,
+            is_banned BOOLEAN DEFAULT FALSE,
+            ban_message_id BIGINT DEFAULT NULL -- ID сообщения о бане для удаления
+        );
+    ''')
+    # Таблица жалоб
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            report_id SERIAL PRIMARY KEY,
+            sender_id BIGINT,
+            sender_username TEXT,
+            reason TEXT,
+            target_id BIGINT,
+            target_username TEXT,
+            report_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'pending', -- pending, approved, rejected
+            message_id BIGINT DEFAULT NULL -- ID сообщения с жалобой у пользователя (для редактирования)
+        );
+    ''')
+
+async def migration_002_keyset_indexes(conn):
+    # Индексы под keyset-пагинацию админских списков
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS reports_pending_time_idx
+        ON reports (report_time, report_id) WHERE status = 'pending';
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS users_banned_reg_date_idx
+        ON users (is_banned, reg_date, user_id);
+    ''')
+
+async def migration_003_counters(conn):
+    # Счётчики для админ-списков поддерживаются триггерами, чтобы страницы не делали COUNT(*).
+    # Таблицы заблокированы до конца транзакции миграции - начальные значения не разъедутся с триггерами.
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        );
+    ''')
+    await conn.execute('LOCK TABLE reports, users IN SHARE ROW EXCLUSIVE MODE')
+    await conn.execute('''
+        CREATE OR REPLACE FUNCTION count_pending_reports_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            delta BIGINT := 0;
+        BEGIN
+            IF TG_OP <> 'DELETE' AND NEW.status = 'pending' THEN delta := delta + 1; END IF;
+            IF TG_OP <> 'INSERT' AND OLD.status = 'pending' THEN delta := delta - 1; END IF;
+            IF delta <> 0 THEN
+                UPDATE counters SET value = value + delta WHERE name = 'pending_reports';
+            END IF;
+            RETURN NULL;
+        END $$;
+    ''')
+    await conn.execute('''
+        CREATE OR REPLACE FUNCTION count_users_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                UPDATE counters SET value = value + 1
+                WHERE name = CASE WHEN NEW.is_banned THEN 'banned_users' ELSE 'users' END;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                UPDATE counters SET value = value - 1
+                WHERE name = CASE WHEN OLD.is_banned THEN 'banned_users' ELSE 'users' END;
+            END IF;
+            RETURN NULL;
+        END $$;
+    ''')
+    await conn.execute('''
+        DROP TRIGGER IF EXISTS reports_count ON reports;
+        CREATE TRIGGER reports_count AFTER INSERT OR DELETE OR UPDATE OF status ON reports
+        FOR EACH ROW EXECUTE FUNCTION count_pending_reports_trg();
+        DROP TRIGGER IF EXISTS users_count ON users;
+        CREATE TRIGGER users_count AFTER INSERT OR DELETE OR UPDATE OF is_banned ON users
+        FOR EACH ROW EXECUTE FUNCTION count_users_trg();
+    ''')
+    # Начальные значения считаем один раз, дальше их ведут триггеры
+    await conn.execute('''
+        INSERT INTO counters (name, value) VALUES
+            ('pending_reports', (SELECT COUNT(*) FROM reports WHERE status = 'pending')),
+            ('users', (SELECT COUNT(*) FROM users WHERE is_banned IS NOT TRUE)),
+            ('banned_users', (SELECT COUNT(*) FROM users WHERE is_banned IS TRUE))
+        ON CONFLICT (name) DO NOTHING;
+    ''')
+
+async def migration_004_fsm_and_rate_limits(conn):
+    # Состояния FSM (см. PostgresStorage)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS fsm_states_updated_at_idx ON fsm_states (updated_at);')
+    # Сохранённые лимиты на жалобы (см. SenderRateLimiter, RATE_LIMIT_PERSIST)
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            name TEXT,
+            sender_id BIGINT,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, sender_id)
+        );
+    ''')
+
+async def migration_005_report_dedup(conn):
+    # Подавление дублей жалоб (см. report_dedup_key)
+    await conn.execute('ALTER TABLE reports ADD COLUMN IF NOT EXISTS dedup_key TEXT DEFAULT NULL;')
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS reports_dedup_key_idx
+        ON reports (dedup_key) WHERE dedup_key IS NOT NULL;
+    ''')
+
+async def migration_006_reports_archive(conn):
+    # Архив решённых жалоб, по разделу на месяц (report_time). В reports остаются только свежие,
+    # так что очередь pending и её индексы не растут вместе с историей.
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports_archive (
+            report_id INT NOT NULL,
+            sender_id BIGINT,
+            sender_username TEXT,
+            reason TEXT,
+            target_id BIGINT,
+            target_username TEXT,
+            report_time TIMESTAMP NOT NULL,
+            status TEXT,
+            message_id BIGINT,
+            dedup_key TEXT,
+            archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (report_id, report_time)
+        ) PARTITION BY RANGE (report_time);
+    ''')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS reports_resolved_time_idx
+        ON reports (report_time) WHERE status <> 'pending';
+    ''')
+
+async def migration_007_admin_search(conn):
+    # Поиск по username: триграммный GIN для нечёткого совпадения и LIKE 'abc%',
+    # плюс btree text_pattern_ops для коротких префиксов, где триграмм ещё нет
+    await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS users_username_trgm_idx ON users USING GIN (lower(username) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS users_username_prefix_idx ON users (lower(username) text_pattern_ops);
+        CREATE INDEX IF NOT EXISTS reports_sender_username_trgm_idx ON reports USING GIN (lower(sender_username) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS reports_sender_username_prefix_idx ON reports (lower(sender_username) text_pattern_ops);
+    ''')
+
+async def migration_008_report_stats(conn):
+    # Сводная статистика ведётся триггером: счётчики по (день жалобы, причина, статус) и гистограмма
+    # времени решения по дням решения. Бакет b - от 2^(b/4) до 2^((b+1)/4) секунд, то есть шаг ~19%.
+    # Удаление (перенос в архив) статистику не трогает - она про всю историю.
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS report_stats (
+            day DATE NOT NULL,
+            reason TEXT NOT NULL,
+            status TEXT NOT NULL,
+            reports BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, reason, status)
+        );
+        CREATE TABLE IF NOT EXISTS report_resolution_stats (
+            day DATE NOT NULL,
+            bucket INT NOT NULL,
+            reports BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, bucket)
+        );
+    ''')
+    await conn.execute('LOCK TABLE reports, reports_archive IN SHARE ROW EXCLUSIVE MODE')
+    await conn.execute('''
+        CREATE OR REPLACE FUNCTION report_stats_trg() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            seconds DOUBLE PRECISION;
+        BEGIN
+            IF TG_OP = 'UPDATE' THEN
+                IF OLD.status IS NOT DISTINCT FROM NEW.status THEN
+                    RETURN NULL;
+                END IF;
+                UPDATE report_stats SET reports = reports - 1
+                WHERE day = OLD.report_time::DATE AND reason = COALESCE(OLD.reason, '') AND status = COALESCE(OLD.status, '');
+                IF OLD.status = 'pending' THEN
+                    seconds := GREATEST(EXTRACT(EPOCH FROM CURRENT_TIMESTAMP::TIMESTAMP - NEW.report_time), 1);
+                    INSERT INTO report_resolution_stats (day, bucket, reports)
+                    VALUES (CURRENT_DATE, FLOOR(4 * LOG(2, seconds::NUMERIC))::INT, 1)
+                    ON CONFLICT (day, bucket) DO UPDATE SET reports = report_resolution_stats.reports + 1;
+                END IF;
+            END IF;
+            INSERT INTO report_stats (day, reason, status, reports)
+            VALUES (NEW.report_time::DATE, COALESCE(NEW.reason, ''), COALESCE(NEW.status, ''), 1)
+            ON CONFLICT (day, reason, status) DO UPDATE SET reports = report_stats.reports + 1;
+            RETURN NULL;
+        END $$;
+    ''')
+    await conn.execute('''
+        DROP TRIGGER IF EXISTS reports_stats ON reports;
+        CREATE TRIGGER reports_stats AFTER INSERT OR UPDATE OF status ON reports
+        FOR EACH ROW EXECUTE FUNCTION report_stats_trg();
+    ''')
+    # Начальные значения - из reports и архива; время решения для старых жалоб неизвестно
+    await conn.execute('''
+        INSERT INTO report_stats (day, reason, status, reports)
+        SELECT report_time::DATE, COALESCE(reason, ''), COALESCE(status, ''), COUNT(*)
+        FROM (
+            SELECT report_time, reason, status FROM reports
+            UNION ALL
+            SELECT report_time, reason, status FROM reports_archive
+        ) all_reports
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, reason, status) DO NOTHING;
+    ''')
+
+# (версия, описание, функция). Только добавлять в конец, уже выпущенные миграции не менять.
+# Первые миграции идемпотентны (IF NOT EXISTS) - на базах, созданных до schema_version, они просто ничего не меняют.
+MIGRATIONS = [
+    (1, "таблицы users и reports", migration_001_initial),
+    (2, "индексы для keyset-пагинации", migration_002_keyset_indexes),
+    (3, "счётчики для админ-списков", migration_003_counters),
+    (4, "состояния FSM и лимиты на жалобы", migration_004_fsm_and_rate_limits),
+    (5, "подавление дублей жалоб", migration_005_report_dedup),
+    (6, "архив жалоб по месяцам", migration_006_reports_archive),
+    (7, "индексы для поиска в админ-панели", migration_007_admin_search),
+    (8, "сводная статистика модерации", migration_008_report_stats),
+]
+
+async def get_schema_version(conn) -> int:
+    try:
+        return await conn.fetchval('SELECT MAX(version) FROM schema_version') or 0
+    except asyncpg.UndefinedTableError:
+        return 0
+
+async def run_migrations(conn):
+    latest = MIGRATIONS[-1][0]
+    if await get_schema_version(conn) >= latest:
+        return # Схема актуальна - быстрый путь
+    await conn.execute('SELECT pg_advisory_lock($1)', MIGRATION_LOCK_ID)
+    try:
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        current = await get_schema_version(conn) # Пока ждали блокировку, миграции мог применить другой процесс
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            async with conn.transaction():
+                await migrate(conn)
+                await conn.execute('INSERT INTO schema_version (version, description) VALUES ($1, $2)', version, description)
+            logging.info(f"Применена миграция {version}: {description}")
+    finally:
+        await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_ID)
+
 async def init_db():
     global db_pool
     try:
-        db_pool = await asyncpg.create_pool(DATABASE_URL)
-        async with db_pool.acquire() as conn:
-            # Таблица пользователей
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    reg_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    total_reports INT DEFAULT 0,
-                    is_banned BOOLEAN DEFAULT FALSE,
-                    ban_message_id BIGINT DEFAULT NULL -- ID сообщения о бане для удаления
-                );
-            ''')
-            # Таблица жалоб
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS reports (
-                    report_id SERIAL PRIMARY KEY,
-                    sender_id BIGINT,
-                    sender_username TEXT,
-                    reason TEXT,
-                    target_id BIGINT,
-                    target_username TEXT,
-                    report_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'pending', -- pending, approved, rejected
-                    message_id BIGINT DEFAULT NULL -- ID сообщения с жалобой у пользователя (для редактирования)
-                );
-            ''')
-        logging.info("База данных инициализирована и таблицы проверены/созданы.")
+        # Миграции - отдельным соединением до пула: пул готовит запросы к уже существующим таблицам
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await run_migrations(conn)
+        finally:
+            await conn.close()
+        # create_pool сразу открывает DB_POOL_MIN_SIZE соединений и готовит на них запросы - это и есть прогрев
+        db_pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+            connection_class=BotConnection,
+            init=init_connection,
+        )
+        logging.info(f"База данных инициализирована, версия схемы {MIGRATIONS[-1][0]}.")
     except Exception as e:
         logging.error(f"Ошибка инициализации БД: {e}")
         exit(f"Ошибка инициализации БД: {e}")
 
 async def register_user(user_id: int, username: str, first_name: str):
-    async with db_pool.acquire() as conn:
-        await conn.execute('''
-            INSERT INTO users (user_id, username, first_name)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (user_id) DO UPDATE
-            SET username = $2, first_name = $3;
-        ''', user_id, username, first_name)
+    # Пишем в БД только если профиль изменился; изменения копим и сбрасываем пачкой
+    user_data = await get_user_data(user_id)
+    if user_data is None:
+        # Новый пользователь - пишем сразу, чтобы строка уже была к моменту жалобы
+        async with db_acquire("register_user") as conn:
+            row = await conn.fetchrow(f'''
+                INSERT INTO users (user_id, username, first_name)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE
+                SET username = $2, first_name = $3
+                RETURNING {USER_COLUMNS};
+            ''', user_id, username, first_name)
+        user_cache.set(user_id, dict(row))
+        return
+    if user_data['username'] == username and user_data['first_name'] == first_name:
+        return
+    pending_registrations[user_id] = (username, first_name)
+    user_cache.update(user_id, username=username, first_name=first_name)
+
+async def flush_registrations():
+    # Один bulk upsert через unnest для всех накопленных изменений профилей
+    if not pending_registrations:
+        return
+    batch = dict(pending_registrations)
+    pending_registrations.clear()
+    user_ids = list(batch)
+    try:
+        async with db_acquire("flush_registrations") as conn:
+            await conn.execute('''
+                INSERT INTO users (user_id, username, first_name)
+                SELECT * FROM unnest($1::BIGINT[], $2::TEXT[], $3::TEXT[])
+                ON CONFLICT (user_id) DO UPDATE
+                SET username = EXCLUDED.username, first_name = EXCLUDED.first_name;
+            ''', user_ids, [batch[u][0] for u in user_ids], [batch[u][1] for u in user_ids])
+    except Exception as e:
+        logging.error("Не удалось сохранить профили пользователей (%s шт.): %s", len(batch), e)
+        # Возвращаем в буфер всё, что не было перезаписано более свежими данными
+        for user_id, profile in batch.items():
+            pending_registrations.setdefault(user_id, profile)
+
+async def registration_flush_loop():
+    while True:
+        await asyncio.sleep(REGISTRATION_FLUSH_INTERVAL)
+        await flush_registrations()
+
+async def cleanup_fsm_states():
+    # Удаляем сброшенные (state.clear()) и брошенные на полпути состояния
+    async with db_acquire("cleanup_fsm_states") as conn:
+        result = await conn.execute('''
+            DELETE FROM fsm_states
+            WHERE (state IS NULL AND data = '{}'::JSONB) OR updated_at < CURRENT_TIMESTAMP - $1 * INTERVAL '1 second'
+        ''', FSM_STATE_TTL)
+    logging.info(f"Очистка состояний FSM: {result}")
+
+async def fsm_cleanup_loop():
+    while True:
+        await asyncio.sleep(FSM_CLEANUP_INTERVAL)
+        try:
+            await cleanup_fsm_states()
+        except Exception as e:
+            logging.error(f"Ошибка очистки состояний FSM: {e}")
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+async def ensure_archive_partitions(conn, start: datetime, end: datetime):
+    # Создаёт месячные разделы reports_archive, покрывающие [start, end]
+    month = month_start(start)
+    while month <= end:
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS reports_archive_{month:%Y_%m} PARTITION OF reports_archive
+            FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}');
+        ''')
+        month = next_month(month)
+
+async def archive_reports_batch() -> int:
+    # Переносит до REPORT_ARCHIVE_BATCH решённых жалоб старше REPORT_ARCHIVE_AFTER_DAYS в архив, одной транзакцией.
+    # SKIP LOCKED - несколько процессов бота могут архивировать одновременно, не мешая друг другу
+    async with db_acquire("archive_reports_batch") as conn:
+        async with conn.transaction():
+            bounds = await conn.fetchrow('''
+                SELECT MIN(report_time) AS oldest, CURRENT_TIMESTAMP::TIMESTAMP - $1 * INTERVAL '1 day' AS cutoff
+                FROM reports WHERE status <> 'pending' AND report_time < CURRENT_TIMESTAMP - $1 * INTERVAL '1 day'
+            ''', REPORT_ARCHIVE_AFTER_DAYS)
+            if bounds['oldest'] is None:
+                return 0
+            await ensure_archive_partitions(conn, bounds['oldest'], bounds['cutoff'])
+            result = await conn.execute(f'''
+                WITH moved AS (
+                    DELETE FROM reports WHERE report_id IN (
+                        SELECT report_id FROM reports
+                        WHERE status <> 'pending' AND report_time < CURRENT_TIMESTAMP - $1 * INTERVAL '1 day'
+                        ORDER BY report_time
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING {REPORT_COLUMNS}
+                )
+                INSERT INTO reports_archive ({REPORT_COLUMNS})
+                SELECT {REPORT_COLUMNS}
+                FROM moved;
+            ''', REPORT_ARCHIVE_AFTER_DAYS, REPORT_ARCHIVE_BATCH)
+    return int(result.split()[-1])
+
+async def report_archive_loop():
+    while True:
+        try:
+            total = 0
+            while True:
+                moved = await archive_reports_batch()
+                total += moved
+                if moved < REPORT_ARCHIVE_BATCH:
+                    break
+                await asyncio.sleep(1) # Пауза между пачками, чтобы не занимать пул и не раздувать WAL рывком
+            if total:
+                logging.info(f"В архив перенесено жалоб: {total}")
+        except Exception as e:
+            logging.error(f"Ошибка архивации жалоб: {e}")
+        await asyncio.sleep(REPORT_ARCHIVE_INTERVAL)
 
 async def get_user_data(user_id: int):
-    async with db_pool.acquire() as conn:
-        return await conn.fetchrow('SELECT * FROM users WHERE user_id = $1', user_id)
+    found, user_data = user_cache.get(user_id)
+    if found:
+        return user_data
+    async with db_acquire("get_user_data") as conn:
+        row = await conn.prepared["get_user_data"].fetchrow(user_id)
+    user_data = dict(row) if row else None
+    user_cache.set(user_id, user_data)
+    return user_data
 
-async def increment_user_reports(user_id: int):
-    async with db_pool.acquire() as conn:
-        await conn.execute('UPDATE users SET total_reports = total_reports + 1 WHERE user_id = $1', user_id)
+def report_dedup_key(sender_id: int, reason: str, target_id: int | None, target_username: str | None) -> str | None:
+    # Нормализованный ключ "отправитель + цель + причина + окно времени"; окно - целые интервалы REPORT_DEDUP_WINDOW
+    if REPORT_DEDUP_WINDOW <= 0:
+        return None
+    target = str(target_id) if target_id is not None else (target_username or "").lstrip("@").lower()
+    window = int(time.time() // REPORT_DEDUP_WINDOW)
+    return hashlib.md5(f"{sender_id}|{target}|{(reason or '').strip().lower()}|{window}".encode()).hexdigest()
 
 async def add_report(sender_id: int, sender_username: str, reason: str, target_id: int | None, target_username: str | None, message_id: int | None):
-    async with db_pool.acquire() as conn:
-        report = await conn.fetchrow('''
-            INSERT INTO reports (sender_id, sender_username, reason, target_id, target_username, message_id)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            RETURNING report_id, report_time;
-        ''', sender_id, sender_username, reason, target_id, target_username, message_id)
-        return report['report_id'], report['report_time']
-
-async def get_report_by_id(report_id: int):
-    async with db_pool.acquire() as conn:
-        return await conn.fetchrow('SELECT * FROM reports WHERE report_id = $1', report_id)
+    # Вставка жалобы и увеличение счётчика доносов отправителя - одним запросом в одной транзакции.
+    # Возвращает (report_id, report_time, status, duplicate); для дубля - уже существующая жалоба с её текущим статусом
+    dedup_key = report_dedup_key(sender_id, reason, target_id, target_username)
+    async with db_acquire("add_report") as conn:
+        report = await conn.prepared["add_report"].fetchrow(sender_id, sender_username, reason, target_id, target_username, message_id, dedup_key)
+        if report is None:
+            # Дубль вставлен параллельной транзакцией после начала нашего запроса - дочитываем его
+            report = await conn.prepared["get_report_by_dedup_key"].fetchrow(dedup_key)
+    if report['total_reports'] is not None:
+        user_cache.update(sender_id, total_reports=report['total_reports'])
+    return report['report_id'], report['report_time'], report['status'], report['duplicate']
+
+async def get_report_with_sender(report_id: int):
+    # Жалоба вместе с first_name отправителя (sender_first_name) - одним запросом
+    async with db_acquire("get_report_with_sender") as conn:
+        report = await conn.prepared["get_report_with_sender"].fetchrow(report_id)
+    if report is None:
+        report = await get_archived_report_with_sender(report_id) # Старые решённые жалобы уже в архиве
+    return report
+
+async def get_archived_report_with_sender(report_id: int):
+    async with db_acquire("get_archived_report_with_sender") as conn:
+        return await conn.fetchrow(f'''
+            SELECT {REPORT_COLUMNS_R}, u.first_name AS sender_first_name
+            FROM reports_archive r LEFT JOIN users u ON u.user_id = r.sender_id
+            WHERE r.report_id = $1
+        ''', report_id)
 
 async def update_report_status(report_id: int, status: str):
-    async with db_pool.acquire() as conn:
-        await conn.execute('UPDATE reports SET status = $1 WHERE report_id = $2', status, report_id)
+    # Возвращает обновлённую жалобу с sender_first_name или None, если жалобы нет
+    async with db_acquire("update_report_status") as conn:
+        return await conn.prepared["update_report_status"].fetchrow(status, report_id)
 
-async def get_pending_reports(limit: int, offset: int):
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('SELECT * FROM reports WHERE status = \'pending\' ORDER BY report_time DESC LIMIT $1 OFFSET $2', limit, offset)
+async def resolve_reports_bulk(status: str, report_ids: list[int] | None = None, reason: str | None = None):
+    # Массовое решение жалоб одним UPDATE ... RETURNING: по списку id или по причине.
+    # Уже решённые жалобы не трогаются; возвращает (report_id, sender_id) реально изменённых.
+    async with db_acquire("resolve_reports_bulk") as conn:
+        if report_ids is not None:
+            return await conn.prepared["resolve_reports_by_ids"].fetch(status, report_ids)
+        return await conn.prepared["resolve_reports_by_reason"].fetch(status, reason)
+
+async def get_pending_reasons(limit: int = 10):
+    async with db_acquire("get_pending_reasons") as conn:
+        return await conn.prepared["pending_reasons"].fetch(limit)
+
+async def count_pending_by_reason(reason: str):
+    async with db_acquire("count_pending_by_reason") as conn:
+        return await conn.prepared["count_pending_by_reason"].fetchval(reason)
+
+async def search_admin(query: str, limit: int, offset: int = 0):
+    # query - число (точный user_id/report_id) и/или username с @ или без
+    text = query.strip().lstrip("@").lower()
+    user_id = int(text) if text.isdigit() else None
+    if user_id is not None and user_id >= 2 ** 63:
+        user_id = None # user_id - BIGINT, более длинное число ищется только как username
+    report_id = user_id if user_id is not None and user_id < 2 ** 31 else None # report_id - INT
+    prefix = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    async with db_acquire("search_admin") as conn:
+        return await conn.prepared["admin_search"].fetch(user_id, report_id, text, prefix, limit, offset)
+
+async def get_report_stats(days: int):
+    async with db_acquire("get_report_stats") as conn:
+        return await conn.prepared["report_stats"].fetch(datetime.now().date() - timedelta(days=days - 1))
+
+async def get_pending_reports(limit: int, cursor: tuple | None = None):
+    # cursor = (направление, report_time, report_id) последнего/первого элемента соседней страницы
+    async with db_acquire("get_pending_reports") as conn:
+        if cursor is None:
+            return await conn.prepared["pending_reports_first"].fetch(limit)
+        direction, report_time, report_id = cursor
+        if direction == "n":
+            return await conn.prepared["pending_reports_after"].fetch(limit, report_time, report_id)
+        rows = await conn.prepared["pending_reports_before"].fetch(limit, report_time, report_id)
+        return rows[::-1]
 
 async def count_pending_reports():
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval('SELECT COUNT(*) FROM reports WHERE status = \'pending\'')
+    async with db_acquire("count_pending_reports") as conn:
+        return await conn.prepared["get_counter"].fetchval('pending_reports') or 0
 
-async def get_all_users_db(limit: int, offset: int, banned: bool = False):
-    async with db_pool.acquire() as conn:
-        return await conn.fetch('SELECT * FROM users WHERE is_banned = $1 ORDER BY reg_date DESC LIMIT $2 OFFSET $3', banned, limit, offset)
+async def get_all_users_db(limit: int, cursor: tuple | None = None, banned: bool = False):
+    # cursor = (направление, reg_date, user_id) последнего/первого элемента соседней страницы
+    async with db_acquire("get_all_users_db") as conn:
+        if cursor is None:
+            return await conn.prepared["users_first"].fetch(banned, limit)
+        direction, reg_date, user_id = cursor
+        if direction == "n":
+            return await conn.prepared["users_after"].fetch(banned, limit, reg_date, user_id)
+        rows = await conn.prepared["users_before"].fetch(banned, limit, reg_date, user_id)
+        return rows[::-1]
 
 async def count_all_users_db(banned: bool = False):
-    async with db_pool.acquire() as conn:
-        return await conn.fetchval('SELECT COUNT(*) FROM users WHERE is_banned = $1', banned)
+    async with db_acquire("count_all_users_db") as conn:
+        return await conn.prepared["get_counter"].fetchval('banned_users' if banned else 'users') or 0
 
+# Бан/разбан тем же запросом шлёт NOTIFY (доставляется после коммита) - другие процессы сбрасывают кэш
 async def ban_user_db(user_id: int, ban_message_id: int):
-    async with db_pool.acquire() as conn:
-        await conn.execute('UPDATE users SET is_banned = TRUE, ban_message_id = $1 WHERE user_id = $2', ban_message_id, user_id)
+    async with db_acquire("ban_user_db") as conn:
+        await conn.execute('''
+            WITH updated AS (UPDATE users SET is_banned = TRUE, ban_message_id = $1 WHERE user_id = $2 RETURNING user_id)
+            SELECT pg_notify($3, user_id::TEXT) FROM updated
+        ''', ban_message_id, user_id, USER_CACHE_CHANNEL)
+    user_cache.update(user_id, is_banned=True, ban_message_id=ban_message_id)
+
+async def set_ban_message_id(user_id: int, ban_message_id: int):
+    # Только если пользователя не успели разбанить, пока уходило уведомление
+    async with db_acquire("set_ban_message_id") as conn:
+        updated = await conn.fetchval('''
+            WITH updated AS (UPDATE users SET ban_message_id = $1 WHERE user_id = $2 AND is_banned RETURNING user_id),
+            notified AS (SELECT pg_notify($3, user_id::TEXT) FROM updated)
+            SELECT COUNT(*) FROM notified
+        ''', ban_message_id, user_id, USER_CACHE_CHANNEL)
+    if updated:
+        user_cache.update(user_id, ban_message_id=ban_message_id)
 
 async def unban_user_db(user_id: int):
-    async with db_pool.acquire() as conn:
-        await conn.execute('UPDATE users SET is_banned = FALSE, ban_message_id = NULL WHERE user_id = $1', user_id)
+    async with db_acquire("unban_user_db") as conn:
+        await conn.execute('''
+            WITH updated AS (UPDATE users SET is_banned = FALSE, ban_message_id = NULL WHERE user_id = $1 RETURNING user_id)
+            SELECT pg_notify($2, user_id::TEXT) FROM updated
+        ''', user_id, USER_CACHE_CHANNEL)
+    user_cache.update(user_id, is_banned=False, ban_message_id=None)
+
+def on_user_cache_notify(connection, pid: int, channel: str, payload: str):
+    # Своё же уведомление тоже приходит - лишний промах кэша, данные в нём и так свежие
+    try:
+        user_cache.invalidate(int(payload))
+    except ValueError:
+        logging.warning(f"Непонятное уведомление {channel}: {payload!r}")
+
+async def user_cache_listen_loop():
+    # LISTEN держит соединение всё время работы, поэтому оно отдельное, вне пула.
+    # Пока соединения нет, уведомления теряются - после переподключения кэш сбрасывается целиком.
+    while True:
+        try:
+            conn = await asyncpg.connect(DATABASE_URL)
+        except Exception as e:
+            logging.error(f"Не удалось подключиться для LISTEN {USER_CACHE_CHANNEL}: {e}")
+            await asyncio.sleep(USER_CACHE_LISTEN_PING)
+            continue
+        try:
+            await conn.add_listener(USER_CACHE_CHANNEL, on_user_cache_notify)
+            user_cache.clear()
+            while True:
+                await asyncio.sleep(USER_CACHE_LISTEN_PING)
+                await conn.execute('SELECT 1') # Оборванное соединение иначе не заметить
+        except Exception as e:
+            logging.error(f"Соединение LISTEN {USER_CACHE_CHANNEL} потеряно: {e}")
+        finally:
+            conn.terminate()
+
+# --- ТЕКСТЫ ---
+# Тексты сообщений собраны здесь, чтобы в обработчиках не было копий одного и того же текста.
+# Шаблоны с подстановками - функции с f-строкой: она компилируется вместе с модулем и быстрее str.format.
+# Текст пользователя (причина жалобы) экранируется внутри шаблонов - бот шлёт с parse_mode="HTML".
+# Упоминания (*_mention) приходят из get_user_mention уже экранированными.
+WELCOME_TEXT = (
+    "👋 Добро пожаловать в Telegram Donos.\n\n"
+    "🤖 Я бот, который пишет множество жалоб на пользователя, я являюсь предметом для защиты личных данных пользователей!\n\n"
+    "‼️ Важно ‼️\n"
+    "Если вы будете злоупотреблять ботом, вы будете заблокированы в боте и в скором, возможно, заблокированы в телеграм по причине сноса обычных пользователей."
+)
+CHOOSE_REPORT_TEXT = "Хорошо, выберите заготовку или введите свою жалобу"
+ASK_TARGET_TEXT = "Пожалуйста, ответьте на сообщение пользователя, на которого подаете жалобу, или введите его ID/Username:"
+ASK_TARGET_AFTER_REASON_TEXT = "Теперь, пожалуйста, ответьте на сообщение пользователя, на которого подаете жалобу, или введите его ID/Username:"
+ASK_CUSTOM_REASON_TEXT = "Введите жалобу до 16 символов:"
+STATUS_PENDING_TEXT = "🟡 Ждет одобрения..."
+STATUS_APPROVED_TEXT = "🟢 Одобрена"
+STATUS_REJECTED_TEXT = "🔴 Отказана"
+STATUS_TEXTS = {"pending": STATUS_PENDING_TEXT, "approved": STATUS_APPROVED_TEXT, "rejected": STATUS_REJECTED_TEXT}
+
+def render_report_card(report_id: int, reason: str, sender_id: int, sender_mention: str, target_mention: str, status: str) -> str:
+    return (f"№{report_id} жалоба\n"
+            f"Причина: {escape(reason)}\n"
+            f"ID отправителя: {sender_id}\n"
+            f"Username отправителя: {sender_mention}\n"
+            f"ID/Username на кого подана жалоба: {target_mention}\n"
+            f"Статус: {status}")
+
+def render_report_sent(sender_mention: str, reason: str) -> str:
+    return f"Отправил: {sender_mention}\nПричина: {escape(reason)}\nСтатус: 🟡 Ждет одобрения.."
+
+def render_report_duplicate(sender_mention: str, reason: str, report_id: int, status: str) -> str:
+    return f"Отправил: {sender_mention}\nПричина: {escape(reason)}\nТакая жалоба уже отправлена (№{report_id}). Статус: {status}"
+
+def render_admin_new_report(sender_mention: str, sender_id: int, reason: str, target_mention: str, report_time: datetime) -> str:
+    return (f"📩 **Новая жалоба!**\n"
+            f"**Данные:**\n"
+            f"👤 Username: {sender_mention}\n"
+            f"🆔 ID: {sender_id}\n"
+            f"📄 Текст жалобы: {escape(reason)}\n"
+            f"🎯 На цель: {target_mention}\n"
+            f"⏳ Время жалобы: {report_time:%d.%m.%Y | %H:%M:%S}")
+
+def render_user_profile(user_mention: str, user_id: int, reg_date: datetime, total_reports: int) -> str:
+    return (f"👤 Username: **{user_mention}**\n"
+            f"🆔 ID: **{user_id}**\n"
+            f"⏳ Время регистрации: **{reg_date:%d.%m.%Y %H:%M:%S}**\n"
+            f"🔢 Всего доносов: **{total_reports}**\n"
+            f"🎂 Тариф: **Стандартный**") # Тариф не реализован, пока заглушка
+
+def render_report_resolved(report_id: int, approved: bool) -> str:
+    return f"🟢 Жалоба №{report_id} одобрена!" if approved else f"🔴 Жалоба №{report_id} отказана!"
+
+BANNED_ALERT_TEXT = "🛑 Вы заблокированы и не можете использовать бота."
+
+def render_ban_notice(user_mention: str) -> str:
+    return f"🛑 **{user_mention}**, Вы были заблокированы!\n❌ Теперь бот не будет отвечать на команды, сколько вы бы ни пытались."
+
+def render_unban_notice(user_mention: str) -> str:
+    return f"✅ **{user_mention}**, Вы были разблокированы!"
+
+def render_banned_reply(user_mention: str) -> str:
+    return f"🛑 **{user_mention}**, Вы заблокированы и не можете использовать бота."
+
+def render_user_ban_changed(user_mention: str, banned: bool) -> str:
+    return f"Пользователь {user_mention} заблокирован." if banned else f"Пользователь {user_mention} разблокирован."
+
+# Отправка жалобы
+CUSTOM_REASON_TOO_LONG_TEXT = "🛑 Ошибка! Много символов. Введите жалобу до 16 символов:"
+INVALID_TARGET_ID_TEXT = "Некорректный ID пользователя. Пожалуйста, введите числовой ID или @username."
+TARGET_NOT_DETECTED_TEXT = "Не удалось определить пользователя, на которого подается жалоба. Пожалуйста, ответьте на сообщение или введите ID/Username."
+UNKNOWN_COMMAND_TEXT = "Извините, я не понял вашу команду. Используйте кнопки."
+UNKNOWN_TARGET_NAME = "Неизвестный" # Подпись цели жалобы без username
+
+def render_rate_limited(wait: float) -> str:
+    return f"🛑 Слишком много жалоб. Попробуйте снова через {format_wait(wait)}"
+
+# Админ-панель
+PENDING_REPORTS_HEADER_TEXT = "Нерешённые жалобы:"
+USERS_HEADER_TEXT = "Пользователи, зарегистрированные в боте:"
+BANLIST_HEADER_TEXT = "Пользователи в бан-листе:" # По нему же cb_view_user понимает, что пришли из бан-листа
+REPORT_NOT_FOUND_TEXT = "Жалоба не найдена."
+USER_NOT_FOUND_TEXT = "Пользователь не найден."
+ADMIN_SEARCH_PROMPT_TEXT = "Введите ID пользователя, номер жалобы или username (можно часть):"
+FAST_APPROVE_TEXT = "Быстрое решение жалоб по причине:"
+NO_PENDING_REPORTS_TEXT = "Нерешённых жалоб нет."
+BULK_NOTHING_LEFT_TEXT = "Нерешённых жалоб с этой причиной уже нет."
+EXPORT_PROMPT_TEXT = "Выгрузка в CSV (gzip). Файл придёт отдельным сообщением:"
+EXPORT_BUSY_TEXT = "Предыдущая выгрузка ещё идёт, дождитесь файла."
+EXPORT_STARTED_TEXT = "⏳ Выгрузка запущена, файл придёт в этот чат."
+
+def render_admin_panel(admin_mention: str, cache_stats: str, outbound_stats: str, updates_stats: str, queries_per_update: float) -> str:
+    return (f"Привет! {admin_mention}\n"
+            f"Кэш пользователей: {cache_stats}\n"
+            f"Очередь отправки: {outbound_stats}\n"
+            f"Апдейты: {updates_stats}, запросов к БД на апдейт {queries_per_update:.2f}")
+
+def render_search_results(query: str, found: bool) -> str:
+    query = escape(query) # Запрос админ вводит как угодно, в том числе с "<"
+    return f"Результаты поиска «{query}»:" if found else f"По запросу «{query}» ничего не найдено."
+
+def render_bulk_confirm(approved: bool, reason: str, total: int) -> str:
+    return (f"{'🟢 Одобрить' if approved else '🔴 Отказать'} все ожидающие жалобы с причиной «{escape(reason)}»? "
+            f"Сейчас их {total}.")
+
+def render_bulk_done(approved: bool, total: int) -> str:
+    return f"{'🟢 Одобрено' if approved else '🔴 Отказано'} жалоб: {total}"
+
+def render_export_too_big(filename: str, size: int) -> str:
+    return f"🛑 Файл выгрузки {filename} слишком большой ({size // (1024 * 1024)} МБ). Сузьте период или фильтр."
+
+def render_export_failed(filename: str, error: Exception) -> str:
+    return f"🛑 Не удалось выгрузить {filename}: {escape(str(error))}"
 
 # --- КЛАВИАТУРЫ ---
+# Неизменные клавиатуры собираются один раз при импорте, клавиатуры с параметрами кэшируются
+# (lru_cache). Разметка только сериализуется при отправке, поэтому один объект можно отдавать всем.
 
 # 1. Приветственная клавиатура
-def get_welcome_kb(is_admin: bool):
+def build_welcome_kb(is_admin: bool):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="📩 Отправить донос", callback_data="start_report"))
     if is_admin:
         builder.row(InlineKeyboardButton(text="⚙️ Админ-панель", callback_data="admin_panel"))
     return builder.as_markup()
 
+WELCOME_KB = {False: build_welcome_kb(False), True: build_welcome_kb(True)}
+
+def get_welcome_kb(is_admin: bool):
+    return WELCOME_KB[is_admin]
+
 # 2. Клавиатура выбора заготовки/своей жалобы
-def get_report_options_kb():
+def build_report_options_kb():
     builder = InlineKeyboardBuilder()
     builder.row(
         InlineKeyboardButton(text="🥷 Мошенничество", callback_data="report_preset:Мошенничество"),
@@ -172,7 +1715,13 @@ def get_report_options_kb():
     )
     return builder.as_markup()
 
+REPORT_OPTIONS_KB = build_report_options_kb()
+
+def get_report_options_kb():
+    return REPORT_OPTIONS_KB
+
 # 3. Клавиатура после отправки жалобы
+@lru_cache(maxsize=8)
 def get_report_sent_kb(admin_username: str):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="Моментальное одобрение 🟢", url=f"https://t.me/{admin_username}"))
@@ -180,29 +1729,78 @@ def get_report_sent_kb(admin_username: str):
     return builder.as_markup()
 
 # 4. Админ-панель
-def get_admin_panel_kb():
+def build_admin_panel_kb():
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="🛑 Жалобы", callback_data="admin_reports:0"))
     builder.row(InlineKeyboardButton(text="👤 Пользователи", callback_data="admin_users:0"))
     builder.row(InlineKeyboardButton(text="❌ Бан-лист", callback_data="admin_banlist:0"))
     builder.row(InlineKeyboardButton(text="🟢 Быстрое одобрение", callback_data="admin_fast_approve"))
+    builder.row(InlineKeyboardButton(text="🔍 Поиск", callback_data="admin_search"))
+    builder.row(InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats"))
+    builder.row(InlineKeyboardButton(text="📤 Экспорт", callback_data="admin_export"))
     builder.row(InlineKeyboardButton(text="◀️ В меню", callback_data="back_to_main"))
     return builder.as_markup()
 
+ADMIN_PANEL_KB = build_admin_panel_kb()
+
+def get_admin_panel_kb():
+    return ADMIN_PANEL_KB
+
+# Кнопка возврата в админ-панель (последний ряд почти всех админских экранов) и клавиатура из неё одной
+BACK_TO_ADMIN_BUTTON = InlineKeyboardButton(text="◀️ Назад в Админ-панель", callback_data="admin_panel")
+BACK_TO_ADMIN_KB = InlineKeyboardMarkup(inline_keyboard=[[BACK_TO_ADMIN_BUTTON]])
+
 # 5. Пагинация для админ-панели (списки жалоб/пользователей)
-async def get_pagination_kb(callback_prefix: str, current_page: int, total_items: int, items_per_page: int, get_items_func, is_banned_list: bool = False):
+# Курсор кладётся прямо в callback_data: "<префикс>:<страница>:<n|p>:<время в мкс>:<id>",
+# "n" - элементы после курсора (вперёд), "p" - перед курсором (назад). Первая страница - "<префикс>:0".
+EPOCH = datetime(1970, 1, 1)
+
+def encode_page_callback(callback_prefix: str, page: int, direction: str, sort_value: datetime, item_id: int) -> str:
+    return f"{callback_prefix}:{page}:{direction}:{(sort_value - EPOCH) // timedelta(microseconds=1)}:{item_id}"
+
+# Список id для массовых действий: base36 через точку, чтобы страница влезла в 64 байта callback_data
+def encode_id_list(ids: list[int]) -> str:
+    parts = []
+    for n in ids:
+        digits = ""
+        while True:
+            n, r = divmod(n, 36)
+            digits = "0123456789abcdefghijklmnopqrstuvwxyz"[r] + digits
+            if not n:
+                break
+        parts.append(digits)
+    return ".".join(parts)
+
+def decode_id_list(data: str) -> list[int]:
+    return [int(part, 36) for part in data.split(".") if part]
+
+def parse_page_args(args: list[str]) -> tuple[int, tuple | None]:
+    page = int(args[0])
+    if len(args) < 4:
+        return page, None
+    return page, (args[1], EPOCH + timedelta(microseconds=int(args[2])), int(args[3]))
+
+async def get_pagination_kb(callback_prefix: str, current_page: int, total_items: int, items_per_page: int, get_items_func, is_banned_list: bool = False, cursor: tuple | None = None):
     builder = InlineKeyboardBuilder()
     total_pages = (total_items + items_per_page - 1) // items_per_page if total_items > 0 else 1
     
     # Добавляем кнопки для каждого элемента на текущей странице
     items = []
     if callback_prefix == "admin_reports":
-        items = await get_items_func(limit=items_per_page, offset=current_page * items_per_page)
+        sort_key, id_key = "report_time", "report_id"
+        items = await get_items_func(limit=items_per_page, cursor=cursor)
         for item in items:
             text = f"#{item['report_id']} {item['reason']}"
             builder.row(InlineKeyboardButton(text=text, callback_data=f"view_report:{item['report_id']}"))
+        if items:
+            page_ids = encode_id_list([item['report_id'] for item in items])
+            builder.row(
+                InlineKeyboardButton(text="🟢 Одобрить страницу", callback_data=f"bulk_page:approve:{page_ids}"),
+                InlineKeyboardButton(text="🔴 Отказать страницу", callback_data=f"bulk_page:reject:{page_ids}")
+            )
     elif callback_prefix in ["admin_users", "admin_banlist"]:
-        items = await get_items_func(limit=items_per_page, offset=current_page * items_per_page, banned=is_banned_list)
+        sort_key, id_key = "reg_date", "user_id"
+        items = await get_items_func(limit=items_per_page, cursor=cursor, banned=is_banned_list)
         for item in items:
             text = f"@{item['username']}" if item['username'] else f"ID: {item['user_id']}"
             builder.row(InlineKeyboardButton(text=text, callback_data=f"view_user:{item['user_id']}"))
@@ -210,29 +1808,36 @@ async def get_pagination_kb(callback_prefix: str, current_page: int, total_items
     # Кнопки пагинации
     nav_row = []
     if current_page > 0:
-        nav_row.append(InlineKeyboardButton(text="◀️", callback_data=f"{callback_prefix}:{current_page - 1}"))
+        if current_page == 1 or not items:
+            prev_data = f"{callback_prefix}:0"
+        else:
+            prev_data = encode_page_callback(callback_prefix, current_page - 1, "p", items[0][sort_key], items[0][id_key])
+        nav_row.append(InlineKeyboardButton(text="◀️", callback_data=prev_data))
     
     nav_row.append(InlineKeyboardButton(text=f"{current_page + 1}/{total_pages}", callback_data="noop"))
     
-    if current_page < total_pages - 1:
-        nav_row.append(InlineKeyboardButton(text="▶️", callback_data=f"{callback_prefix}:{current_page + 1}"))
+    if current_page < total_pages - 1 and items:
+        next_data = encode_page_callback(callback_prefix, current_page + 1, "n", items[-1][sort_key], items[-1][id_key])
+        nav_row.append(InlineKeyboardButton(text="▶️", callback_data=next_data))
     
     if nav_row:
         builder.row(*nav_row)
     
-    builder.row(InlineKeyboardButton(text="◀️ Назад в Админ-панель", callback_data="admin_panel"))
+    builder.row(BACK_TO_ADMIN_BUTTON)
     return builder.as_markup()
 
 # 6. Клавиатура для просмотра конкретной жалобы
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def get_report_actions_kb(report_id: int):
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="🟢 Одобрить", callback_data=f"report_action:approve:{report_id}"))
     builder.row(InlineKeyboardButton(text="🔴 Отказать", callback_data=f"report_action:reject:{report_id}"))
     builder.row(InlineKeyboardButton(text="▶ Следующая жалоба", callback_data="admin_reports:0")) # Просто возвращаемся к списку
-    builder.row(InlineKeyboardButton(text="◀️ Назад в Админ-панель", callback_data="admin_panel"))
+    builder.row(BACK_TO_ADMIN_BUTTON)
     return builder.as_markup()
 
 # 7. Клавиатура для просмотра профиля пользователя
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def get_user_profile_kb(user_id: int, is_banned: bool, from_banlist: bool = False):
     builder = InlineKeyboardBuilder()
     if is_banned:
@@ -252,13 +1857,238 @@ async def check_admin(user_id: int) -> bool:
     return ADMIN_ID is not None and user_id == ADMIN_ID
 
 async def get_user_mention(user_id: int, username: str | None, first_name: str | None) -> str:
+    # Упоминание уходит в сообщения с parse_mode="HTML" как готовый фрагмент - имя экранируем здесь.
+    # Username цели жалобы вводит пользователь, поэтому экранируется тоже.
     if username:
-        return f"@{username}"
+        return f"@{escape(username)}"
     elif first_name:
-        return f"<a href='tg://user?id={user_id}'>{first_name}</a>"
+        return f"<a href='tg://user?id={user_id}'>{escape(first_name)}</a>"
     else:
         return f"ID: {user_id}"
 
+async def _as_background(coro):
+    outbound_priority.set(PRIORITY_BACKGROUND) # Отправки из фона уступают интерактивным ответам
+    update_scope.set(None) # Контекст скопирован из апдейта, но его запросы уже не его
+    return await coro
+
+def run_in_background(coro):
+    # Запускает корутину вне пути обработки апдейта
+    task = asyncio.create_task(_as_background(coro))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def notify_admin_new_report(sender_mention: str, sender_id: int, reason: str, target_id: int | None, target_username: str | None, report_time: datetime):
+    target_mention_admin = await get_user_mention(target_id, target_username, UNKNOWN_TARGET_NAME)
+    try:
+        await bot.send_message(
+            ADMIN_ID,
+            render_admin_new_report(sender_mention=sender_mention, sender_id=sender_id, reason=reason,
+                                    target_mention=target_mention_admin, report_time=report_time),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logging.error("Не удалось отправить уведомление админу о жалобе от %s: %s", sender_id, e)
+
+async def notify_report_resolved(sender_id: int, report_id: int, approved: bool):
+    try:
+        await bot.send_message(sender_id, render_report_resolved(report_id, approved))
+    except Exception as e:
+        logging.error("Не удалось отправить уведомление пользователю %s: %s", sender_id, e)
+
+async def notify_reports_resolved_bulk(rows, approved: bool):
+    # Одно сообщение на отправителя со всеми его решёнными жалобами; отправка идёт через
+    # очередь исходящих с фоновым приоритетом, поэтому лимиты Telegram соблюдаются сами
+    by_sender: dict[int, list[int]] = {}
+    for row in rows:
+        by_sender.setdefault(row['sender_id'], []).append(row['report_id'])
+
+    async def send(sender_id: int, report_ids: list[int]):
+        if len(report_ids) == 1:
+            await notify_report_resolved(sender_id, report_ids[0], approved)
+            return
+        shown = ", ".join(f"№{report_id}" for report_id in sorted(report_ids)[:BULK_NOTIFY_MAX_IDS])
+        if len(report_ids) > BULK_NOTIFY_MAX_IDS:
+            shown += f" и ещё {len(report_ids) - BULK_NOTIFY_MAX_IDS}"
+        text = f"🟢 Жалобы {shown} одобрены!" if approved else f"🔴 Жалобы {shown} отказаны!"
+        try:
+            await bot.send_message(sender_id, text)
+        except Exception as e:
+            logging.error("Не удалось отправить уведомление пользователю %s: %s", sender_id, e)
+
+    await asyncio.gather(*(send(sender_id, report_ids) for sender_id, report_ids in by_sender.items()))
+    logging.info(f"Массовое решение: {len(rows)} жалоб, уведомлено отправителей: {len(by_sender)}")
+
+async def notify_banned(user_id: int, user_mention: str):
+    try:
+        ban_msg = await bot.send_message(user_id, render_ban_notice(user_mention), parse_mode="HTML")
+    except Exception as e:
+        logging.error("Не удалось отправить уведомление о бане пользователю %s: %s", user_id, e)
+        return
+    await set_ban_message_id(user_id, ban_msg.message_id)
+
+async def notify_unbanned(user_id: int, user_mention: str, ban_message_id: int | None):
+    if ban_message_id:
+        try:
+            await bot.delete_message(user_id, ban_message_id)
+        except TelegramBadRequest:
+            logging.warning("Не удалось удалить сообщение о бане для %s", user_id)
+    try:
+        await bot.send_message(user_id, render_unban_notice(user_mention), parse_mode="HTML")
+    except Exception as e:
+        logging.error("Не удалось отправить уведомление о разбане пользователю %s: %s", user_id, e)
+
+# --- ЭКСПОРТ ---
+# Выгрузка жалоб (вместе с архивом) и пользователей в CSV.gz: COPY ... TO STDOUT отдаёт строки потоком,
+# они сжимаются кусками в отдельном потоке, так что память постоянна, а event loop не блокируется.
+# COPY идёт по своему соединению - долгая выгрузка не занимает соединение пула у обработчиков.
+EXPORT_QUERIES = {
+    # $1 - статус (NULL - любой), $2 - с какого времени (NULL - за всё время)
+    "reports": '''
+        SELECT report_id, sender_id, sender_username, reason, target_id, target_username, report_time, status
+        FROM reports WHERE ($1::TEXT IS NULL OR status = $1) AND ($2::TIMESTAMP IS NULL OR report_time >= $2)
+        UNION ALL
+        SELECT report_id, sender_id, sender_username, reason, target_id, target_username, report_time, status
+        FROM reports_archive WHERE ($1::TEXT IS NULL OR status = $1) AND ($2::TIMESTAMP IS NULL OR report_time >= $2)
+    ''',
+    # $1 - забанен ли (NULL - все), $2 - зарегистрирован не раньше (NULL - за всё время)
+    "users": '''
+        SELECT user_id, username, first_name, reg_date, total_reports, is_banned
+        FROM users WHERE ($1::BOOLEAN IS NULL OR is_banned = $1) AND ($2::TIMESTAMP IS NULL OR reg_date >= $2)
+    ''',
+}
+EXPORT_FILTERS = { # значение из callback_data -> параметр $1
+    "reports": {"all": None, "pending": "pending", "approved": "approved", "rejected": "rejected"},
+    "users": {"all": None, "banned": True},
+}
+
+class GzipChunkWriter:
+    # COPY присылает данные маленькими кусками (порой по строке) - копим до EXPORT_CHUNK_SIZE
+    # и только потом сжимаем и пишем на диск в потоке
+    def __init__(self, path: str):
+        self._file = gzip.open(path, "wb")
+        self._buffer = bytearray()
+        self.raw_bytes = 0
+
+    async def write(self, chunk: bytes):
+        self._buffer += chunk
+        self.raw_bytes += len(chunk)
+        if len(self._buffer) >= EXPORT_CHUNK_SIZE:
+            await self._flush()
+
+    async def _flush(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        await asyncio.to_thread(self._file.write, data)
+
+    async def close(self):
+        await self._flush()
+        await asyncio.to_thread(self._file.close)
+
+export_lock = asyncio.Lock() # Одна выгрузка за раз
+
+async def export_to_admin(table: str, filter_name: str, days: int):
+    since = datetime.now() - timedelta(days=days) if days else None
+    filename = f"{table}_{filter_name}_{f'{days}d' if days else 'all'}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv.gz"
+    fd, path = tempfile.mkstemp(prefix=f"{table}_", suffix=".csv.gz", dir=EXPORT_DIR)
+    os.close(fd)
+    async with export_lock:
+        start = time.monotonic()
+        try:
+            writer = GzipChunkWriter(path)
+            try:
+                conn = await asyncpg.connect(DATABASE_URL)
+                try:
+                    await conn.copy_from_query(EXPORT_QUERIES[table], EXPORT_FILTERS[table][filter_name], since,
+                                               output=writer.write, format="csv", header=True)
+                finally:
+                    await conn.close()
+            finally:
+                await writer.close()
+            size = os.path.getsize(path)
+            logging.info(f"Экспорт {filename}: {writer.raw_bytes} байт CSV, {size} байт сжато, {time.monotonic() - start:.1f} с")
+            if size > EXPORT_MAX_UPLOAD:
+                await bot.send_message(ADMIN_ID, render_export_too_big(filename, size))
+                return
+            await bot.send_document(ADMIN_ID, FSInputFile(path, filename=filename), caption=f"📤 {filename}")
+        except Exception as e:
+            logging.error(f"Не удалось выгрузить {filename}: {e}")
+            try:
+                await bot.send_message(ADMIN_ID, render_export_failed(filename, e))
+            except Exception:
+                pass
+        finally:
+            os.remove(path)
+
+# --- УВЕДОМЛЕНИЯ АДМИНУ ---
+# Пока жалоб мало, админ получает каждую отдельным сообщением. Если за ADMIN_DIGEST_INTERVAL
+# их больше ADMIN_DIGEST_THRESHOLD, новые копятся и раз в интервал уходят одной сводкой -
+# чат админа не заваливается, а поканальный лимит отправки не выедается.
+class AdminNotifier:
+    def __init__(self, threshold: int, interval: float, max_ids: int):
+        self.threshold = threshold
+        self.interval = interval
+        self._recent = deque(maxlen=threshold + 1) # Время последних жалоб - хватает, чтобы понять, превышен ли порог
+        self._reasons = {} # причина -> количество в текущей сводке
+        self._ids = deque(maxlen=max_ids)
+        self._pending = 0
+        self._since = None
+        self.digests = 0
+
+    def _burst(self, now: float) -> bool:
+        self._recent.append(now)
+        return self.threshold > 0 and len(self._recent) == self._recent.maxlen and now - self._recent[0] < self.interval
+
+    def new_report(self, report_id: int, sender_mention: str, sender_id: int, reason: str, target_id: int | None, target_username: str | None, report_time: datetime):
+        # Пока сводка не отправлена, новые жалобы тоже идут в неё - иначе порядок для админа перемешается
+        if not self._burst(time.monotonic()) and not self._pending:
+            run_in_background(notify_admin_new_report(sender_mention, sender_id, reason, target_id, target_username, report_time))
+            return
+        if not self._pending:
+            self._since = report_time
+        self._pending += 1
+        self._reasons[reason] = self._reasons.get(reason, 0) + 1
+        self._ids.append(report_id)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, reasons, ids, since = self._pending, self._reasons, list(self._ids), self._since
+        self._pending, self._reasons, self._since = 0, {}, None
+        self._ids.clear()
+
+        top = sorted(reasons.items(), key=lambda item: item[1], reverse=True)
+        lines = [f"📩 Новых жалоб: {pending} (с {since.strftime('%H:%M:%S')})", "По причинам:"]
+        lines += [f"• {escape(reason)}: {count}" for reason, count in top[:10]] # Причина - текст пользователя
+        if len(top) > 10:
+            lines.append(f"• другие: {sum(count for _, count in top[10:])}")
+        lines.append("🆕 Последние: " + ", ".join(f"№{report_id}" for report_id in reversed(ids)))
+        try:
+            await bot.send_message(ADMIN_ID, "\n".join(lines))
+            self.digests += 1
+        except Exception as e:
+            logging.error("Не удалось отправить админу сводку о %s жалобах: %s", pending, e)
+            self._restore(pending, reasons, ids, since)
+
+    def _restore(self, pending: int, reasons: dict, ids: list, since: datetime):
+        # Неотправленная сводка возвращается в буфер и уйдёт со следующей; пока шла отправка,
+        # могли прийти новые жалобы - они новее, поэтому их номера остаются в конце
+        self._pending += pending
+        for reason, count in reasons.items():
+            self._reasons[reason] = self._reasons.get(reason, 0) + count
+        newer = list(self._ids)
+        self._ids.clear()
+        self._ids.extend(ids + newer)
+        self._since = since
+
+admin_notifier = AdminNotifier(ADMIN_DIGEST_THRESHOLD, ADMIN_DIGEST_INTERVAL, ADMIN_DIGEST_MAX_IDS)
+
+async def admin_digest_loop():
+    outbound_priority.set(PRIORITY_BACKGROUND)
+    while True:
+        await asyncio.sleep(ADMIN_DIGEST_INTERVAL)
+        await admin_notifier.flush()
+
 # --- ОБРАБОТЧИКИ ---
 
 # Приветствие
@@ -269,315 +2099,476 @@ async def cmd_start(message: types.Message):
     
     if user_data and user_data['is_banned']:
         user_mention = await get_user_mention(message.from_user.id, message.from_user.username, message.from_user.first_name)
-        await message.answer(f"🛑 **{user_mention}**, Вы были заблокированы!\n❌ Теперь бот не будет отвечать на команды, сколько вы бы ни пытались.", parse_mode="HTML")
+        await message.answer(render_ban_notice(user_mention), parse_mode="HTML")
         return
 
     is_admin = await check_admin(message.from_user.id)
     
-    sent_message = await message.answer(
-        "👋 Добро пожаловать в Telegram Donos.\n\n"
-        "🤖 Я бот, который пишет множество жалоб на пользователя, я являюсь предметом для защиты личных данных пользователей!\n\n"
-        "‼️ Важно ‼️\n"
-        "Если вы будете злоупотреблять ботом, вы будете заблокированы в боте и в скором, возможно, заблокированы в телеграм по причине сноса обычных пользователей.",
-        reply_markup=get_welcome_kb(is_admin)
-    )
+    sent_message = await message.answer(WELCOME_TEXT, reply_markup=get_welcome_kb(is_admin))
     try:
         await bot.pin_chat_message(chat_id=message.chat.id, message_id=sent_message.message_id)
     except TelegramBadRequest as e:
-        logging.warning(f"Не удалось закрепить сообщение в чате {message.chat.id}: {e}")
+        logging.warning("Не удалось закрепить сообщение в чате %s: %s", message.chat.id, e)
 
 # Проверка на бан для всех callback_query
 @dp.callback_query()
 async def check_ban_callback(callback: CallbackQuery, state: FSMContext):
     user_data = await get_user_data(callback.from_user.id)
     if user_data and user_data['is_banned']:
-        await callback.answer(f"🛑 Вы заблокированы и не можете использовать бота.", show_alert=True)
+        await callback.answer(BANNED_ALERT_TEXT, show_alert=True)
         return
     await process_callback_query(callback, state)
 
 # Проверка на бан для всех message
 @dp.message()
-async def check_ban_message(message: types.Message, state: FSMContext):
+async def check_ban_message(message: types.Message, state: FSMContext, raw_state: str | None = None):
     await register_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
     user_data = await get_user_data(message.from_user.id)
     if user_data and user_data['is_banned']:
         user_mention = await get_user_mention(message.from_user.id, message.from_user.username, message.from_user.first_name)
-        await message.answer(f"🛑 **{user_mention}**, Вы заблокированы и не можете использовать бота.", parse_mode="HTML")
+        await message.answer(render_banned_reply(user_mention), parse_mode="HTML")
         return
-    await process_message(message, state)
+    await process_message(message, state, raw_state)
 
 
+# Обработчики callback_query: callback_data имеет вид "<префикс>[:<аргумент>...]",
+# префикс разбирается один раз и ищется в словаре, вместо цепочки if'ов.
+CALLBACK_ROUTES = {} # префикс -> (обработчик, только для админа, текст отказа)
+
+def callback_route(prefix: str, admin_only: bool = False, denied_text: str = "У вас нет доступа."):
+    def decorator(handler):
+        CALLBACK_ROUTES[prefix] = (handler, admin_only, denied_text)
+        return handler
+    return decorator
+
 # Обработчик callback_query (после проверки на бан)
 async def process_callback_query(callback: CallbackQuery, state: FSMContext):
-    # back_to_main
-    if callback.data == "back_to_main":
-        await state.clear()
-        is_admin = await check_admin(callback.from_user.id)
-        await callback.message.edit_text(
-            "👋 Добро пожаловать в Telegram Donos.\n\n"
-            "🤖 Я бот, который пишет множество жалоб на пользователя, я являюсь предметом для защиты личных данных пользователей!\n\n"
-            "‼️ Важно ‼️\n"
-            "Если вы будете злоупотреблять ботом, вы будете заблокированы в боте и в скором, возможно, заблокированы в телеграм по причине сноса обычных пользователей.",
-            reply_markup=get_welcome_kb(is_admin)
-        )
-        await callback.answer()
+    prefix, _, payload = callback.data.partition(":")
+    route = CALLBACK_ROUTES.get(prefix)
+    if route is None:
         return
-
-    # start_report
-    if callback.data == "start_report":
-        await callback.message.edit_text(
-            "Хорошо, выберите заготовку или введите свою жалобу",
-            reply_markup=get_report_options_kb()
-        )
-        await callback.answer()
+    handler, admin_only, denied_text = route
+    if admin_only and not await check_admin(callback.from_user.id):
+        await callback.answer(denied_text, show_alert=True)
         return
+    await handler(callback, state, payload.split(":") if payload else [])
 
-    # report_preset
-    if callback.data.startswith("report_preset:"):
-        reason = callback.data.split(":")[1]
-        await state.update_data(reason=reason) # Сохраняем причину
-        await callback.message.edit_text("Пожалуйста, ответьте на сообщение пользователя, на которого подаете жалобу, или введите его ID/Username:")
-        await state.set_state(ReportStates.waiting_for_target) # Переходим в состояние ожидания цели
-        await callback.answer()
+# back_to_main
+@callback_route("back_to_main")
+async def cb_back_to_main(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    await state.clear()
+    is_admin = await check_admin(callback.from_user.id)
+    await callback.message.edit_text(WELCOME_TEXT, reply_markup=get_welcome_kb(is_admin))
+    await callback.answer()
+
+# start_report
+@callback_route("start_report")
+async def cb_start_report(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    # Отказываем сразу, если лимит кнопки или лимит самих жалоб исчерпан - до отправки жалобы не дойдёт
+    # Сначала проверяем оба лимита и только потом списываем попытку кнопки - отказ по report_limiter её не тратит
+    wait = max(start_report_limiter.retry_after(callback.from_user.id), report_limiter.retry_after(callback.from_user.id))
+    if wait > 0:
+        await callback.answer(render_rate_limited(wait), show_alert=True)
         return
+    start_report_limiter.acquire(callback.from_user.id)
+    await callback.message.edit_text(CHOOSE_REPORT_TEXT, reply_markup=get_report_options_kb())
+    await callback.answer()
+
+# report_preset
+@callback_route("report_preset")
+async def cb_report_preset(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    reason = args[0]
+    await state.update_data(reason=reason) # Сохраняем причину
+    await callback.message.edit_text(ASK_TARGET_TEXT)
+    await state.set_state(ReportStates.waiting_for_target) # Переходим в состояние ожидания цели
+    await callback.answer()
+
+# report_custom (ввод своей жалобы)
+@callback_route("report_custom")
+async def cb_report_custom(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    await callback.message.edit_text(ASK_CUSTOM_REASON_TEXT)
+    await state.set_state(ReportStates.waiting_for_custom_reason) # Переходим в состояние ожидания пользовательской причины
+    await callback.answer()
+
+# admin_panel
+@callback_route("admin_panel", admin_only=True, denied_text="У вас нет доступа к админ-панели.")
+async def cb_admin_panel(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    admin_mention_text = "Pavel Durov"
+    if ADMIN_ID: # Если ADMIN_ID установлен, используем его для упоминания
+        admin_mention = await get_user_mention(ADMIN_ID, ADMIN_USERNAME, admin_mention_text)
+    else: # Иначе просто текст
+        admin_mention = admin_mention_text
+
+    await callback.message.edit_text(
+        render_admin_panel(admin_mention, user_cache.stats(), outbound.stats(), update_limiter.stats(), queries_per_update()),
+        reply_markup=get_admin_panel_kb()
+    )
+    await callback.answer()
+
+# admin_search: ждём запрос (id или username) следующим сообщением
+@callback_route("admin_search", admin_only=True)
+async def cb_admin_search(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    await state.set_state(AdminStates.waiting_for_search)
+    await callback.message.edit_text(ADMIN_SEARCH_PROMPT_TEXT, reply_markup=BACK_TO_ADMIN_KB)
+    await callback.answer()
+
+# Результаты поиска: запрос хранится в callback_data, "search:<страница>:<запрос>"
+SEARCH_PAGE_SIZE = 10
+
+async def get_search_results_kb(query: str, page: int):
+    rows = await search_admin(query, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE) # Лишняя строка - признак следующей страницы
+    builder = InlineKeyboardBuilder()
+    for row in rows[:SEARCH_PAGE_SIZE]:
+        if row['kind'] == "user":
+            text = f"👤 @{row['username']}" if row['username'] else f"👤 ID: {row['item_id']}"
+            builder.row(InlineKeyboardButton(text=text, callback_data=f"view_user:{row['item_id']}"))
+        else:
+            sender = f"@{row['username']}" if row['username'] else "без username"
+            builder.row(InlineKeyboardButton(text=f"🛑 #{row['item_id']} {sender} {row['reason']}", callback_data=f"view_report:{row['item_id']}"))
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="◀️", callback_data=f"search:{page - 1}:{query}"))
+    if len(rows) > SEARCH_PAGE_SIZE:
+        nav_row.append(InlineKeyboardButton(text="▶️", callback_data=f"search:{page + 1}:{query}"))
+    if nav_row:
+        builder.row(*nav_row)
+    builder.row(InlineKeyboardButton(text="🔍 Новый поиск", callback_data="admin_search"))
+    builder.row(BACK_TO_ADMIN_BUTTON)
+    return builder.as_markup(), bool(rows)
+
+# search (страницы результатов поиска)
+@callback_route("search", admin_only=True)
+async def cb_search(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    page = int(args[0])
+    query = ":".join(args[1:])
+    kb, found = await get_search_results_kb(query, page)
+    await callback.message.edit_text(render_search_results(query, found), reply_markup=kb)
+    await callback.answer()
+
+# admin_stats: сводка из report_stats / report_resolution_stats, без сканирования reports
+STATUS_ICONS = {"pending": "🟡", "approved": "🟢", "rejected": "🔴"}
+
+def median_resolution(buckets: dict[int, int]) -> float | None:
+    # Приближённая медиана по гистограмме: середина бакета (в логарифмической шкале), где набралась половина
+    total = sum(buckets.values())
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen * 2 >= total:
+            return 2 ** ((bucket + 0.5) / 4)
+    return None
+
+def status_label(status: str) -> str:
+    # Неизвестный статус выводится как есть - экранируем, сообщение уходит с parse_mode="HTML"
+    return STATUS_ICONS.get(status) or escape(status)
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f} с."
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин."
+    if seconds < 86400:
+        return f"{seconds // 3600:.0f} ч. {seconds % 3600 / 60:.0f} мин."
+    return f"{seconds / 86400:.1f} дн."
+
+@callback_route("admin_stats", admin_only=True)
+async def cb_admin_stats(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    rows = await get_report_stats(STATS_DAYS)
+    by_day, by_reason, by_status, buckets = {}, {}, {}, {}
+    for row in rows:
+        if row['kind'] == "resolution":
+            buckets[row['bucket']] = buckets.get(row['bucket'], 0) + row['reports']
+            continue
+        day = by_day.setdefault(row['day'], {})
+        day[row['status']] = day.get(row['status'], 0) + row['reports']
+        by_reason[row['reason']] = by_reason.get(row['reason'], 0) + row['reports']
+        by_status[row['status']] = by_status.get(row['status'], 0) + row['reports']
+
+    lines = [f"📊 Статистика за {STATS_DAYS} дн.", f"Всего жалоб: {sum(by_status.values())} (" +
+             " ".join(f"{status_label(status)}{count}" for status, count in sorted(by_status.items())) + ")"]
+    median = median_resolution(buckets)
+    lines.append(f"⏱ Медиана времени решения: {'~' + format_duration(median) if median else 'нет данных'}")
+    lines.append("\nПо дням:")
+    for day in sorted(by_day, reverse=True):
+        statuses = by_day[day]
+        lines.append(f"{day.strftime('%d.%m')}: {sum(statuses.values())} (" +
+                     " ".join(f"{status_label(status)}{count}" for status, count in sorted(statuses.items())) + ")")
+    lines.append("\nПо причинам:")
+    top = sorted(by_reason.items(), key=lambda item: item[1], reverse=True)
+    lines += [f"• {escape(reason)}: {count}" for reason, count in top[:10]] # Причина - текст пользователя
+    if len(top) > 10:
+        lines.append(f"• другие: {sum(count for _, count in top[10:])}")
+
+    await callback.message.edit_text("\n".join(lines), reply_markup=BACK_TO_ADMIN_KB)
+    await callback.answer()
 
-    # report_custom (ввод своей жалобы)
-    if callback.data == "report_custom":
-        await callback.message.edit_text("Введите жалобу до 16 символов:")
-        await state.set_state(ReportStates.waiting_for_custom_reason) # Переходим в состояние ожидания пользовательской причины
+# admin_export: выбор таблицы, фильтра и периода; "export:<таблица>:<фильтр>:<дней, 0 - всё время>"
+EXPORT_LABELS = {
+    ("reports", "all"): "Все жалобы",
+    ("reports", "pending"): "🟡 Ожидают",
+    ("reports", "approved"): "🟢 Одобренные",
+    ("reports", "rejected"): "🔴 Отказанные",
+    ("users", "all"): "👤 Пользователи",
+    ("users", "banned"): "❌ Бан-лист",
+}
+
+@callback_route("admin_export", admin_only=True)
+async def cb_admin_export(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    builder = InlineKeyboardBuilder()
+    for (table, filter_name), label in EXPORT_LABELS.items():
+        builder.row(
+            InlineKeyboardButton(text=f"{label}: 7 дн.", callback_data=f"export:{table}:{filter_name}:7"),
+            InlineKeyboardButton(text="30 дн.", callback_data=f"export:{table}:{filter_name}:30"),
+            InlineKeyboardButton(text="всё", callback_data=f"export:{table}:{filter_name}:0")
+        )
+    builder.row(BACK_TO_ADMIN_BUTTON)
+    await callback.message.edit_text(EXPORT_PROMPT_TEXT, reply_markup=builder.as_markup())
+    await callback.answer()
+
+@callback_route("export", admin_only=True)
+async def cb_export(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    table, filter_name, days = args[0], args[1], int(args[2])
+    if (table, filter_name) not in EXPORT_LABELS:
         await callback.answer()
         return
+    if export_lock.locked():
+        await callback.answer(EXPORT_BUSY_TEXT, show_alert=True)
+        return
+    run_in_background(export_to_admin(table, filter_name, days)) # Обработчик не ждёт выгрузку
+    await callback.answer(EXPORT_STARTED_TEXT)
+
+# admin_reports
+@callback_route("admin_reports", admin_only=True)
+async def cb_admin_reports(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    page, cursor = parse_page_args(args)
+    items_per_page = 5
+    total_reports = await count_pending_reports()
     
-    # admin_panel
-    if callback.data == "admin_panel":
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа к админ-панели.", show_alert=True)
-            return
-        
-        admin_mention_text = "Pavel Durov"
-        if ADMIN_ID: # Если ADMIN_ID установлен, используем его для упоминания
-            admin_mention = await get_user_mention(ADMIN_ID, ADMIN_USERNAME, admin_mention_text)
-        else: # Иначе просто текст
-            admin_mention = admin_mention_text
+    kb = await get_pagination_kb("admin_reports", page, total_reports, items_per_page, get_pending_reports, cursor=cursor)
+    await callback.message.edit_text(PENDING_REPORTS_HEADER_TEXT, reply_markup=kb)
+    await callback.answer()
 
+# view_report
+@callback_route("view_report", admin_only=True)
+async def cb_view_report(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    report_id = int(args[0])
+    report = await get_report_with_sender(report_id)
+    if report:
+        sender_mention = await get_user_mention(report['sender_id'], report['sender_username'], report['sender_first_name'])
+        target_mention = await get_user_mention(report['target_id'], report['target_username'], UNKNOWN_TARGET_NAME) # Если target_id нет, то username
+        
         await callback.message.edit_text(
-            f"Привет! {admin_mention}\n",
-            reply_markup=get_admin_panel_kb()
+            render_report_card(report_id=report['report_id'], reason=report['reason'], sender_id=report['sender_id'],
+                               sender_mention=sender_mention, target_mention=target_mention, status=STATUS_PENDING_TEXT),
+            reply_markup=get_report_actions_kb(report_id)
         )
-        await callback.answer()
-        return
+    else:
+        await callback.message.edit_text(REPORT_NOT_FOUND_TEXT)
+    await callback.answer()
 
-    # admin_reports
-    if callback.data.startswith("admin_reports:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        page = int(callback.data.split(":")[1])
-        items_per_page = 5
-        total_reports = await count_pending_reports()
+# report_action (approve/reject)
+@callback_route("report_action", admin_only=True)
+async def cb_report_action(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    action = args[0]
+    report_id = int(args[1])
+    
+    new_status = "approved" if action == "approve" else "rejected"
+    report = await update_report_status(report_id, new_status) # Обновление и чтение жалобы с отправителем - один запрос
+    if report:
+        sender_mention = await get_user_mention(report['sender_id'], report['sender_username'], report['sender_first_name'])
         
-        kb = await get_pagination_kb("admin_reports", page, total_reports, items_per_page, get_pending_reports)
-        await callback.message.edit_text("Нерешённые жалобы:", reply_markup=kb)
-        await callback.answer()
-        return
+        # Уведомляем пользователя, который отправил жалобу (в фоне, через очередь отправки)
+        run_in_background(notify_report_resolved(report['sender_id'], report_id, action == "approve"))
+        
+        # Обновляем сообщение в админ-панели
+        target_mention = await get_user_mention(report['target_id'], report['target_username'], UNKNOWN_TARGET_NAME)
+        await callback.message.edit_text(
+            render_report_card(report_id=report['report_id'], reason=report['reason'], sender_id=report['sender_id'],
+                               sender_mention=sender_mention, target_mention=target_mention,
+                               status=STATUS_APPROVED_TEXT if action == "approve" else STATUS_REJECTED_TEXT),
+            reply_markup=get_report_actions_kb(report_id) # Можно обновить на другую клавиатуру, без кнопок одобрения/отказа
+        )
+    await callback.answer()
 
-    # view_report
-    if callback.data.startswith("view_report:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        report_id = int(callback.data.split(":")[1])
-        report = await get_report_by_id(report_id)
-        if report:
-            sender_user_data = await get_user_data(report['sender_id'])
-            sender_mention = await get_user_mention(report['sender_id'], report['sender_username'], sender_user_data['first_name'])
-            target_mention = await get_user_mention(report['target_id'], report['target_username'], "Неизвестный") # Если target_id нет, то username
-            
-            await callback.message.edit_text(
-                f"№{report['report_id']} жалоба\n"
-                f"Причина: {report['reason']}\n"
-                f"ID отправителя: {report['sender_id']}\n"
-                f"Username отправителя: {sender_mention}\n"
-                f"ID/Username на кого подана жалоба: {target_mention}\n"
-                f"Статус: 🟡 Ждет одобрения...",
-                reply_markup=get_report_actions_kb(report_id)
-            )
-        else:
-            await callback.message.edit_text("Жалоба не найдена.")
-        await callback.answer()
-        return
+# admin_users
+@callback_route("admin_users", admin_only=True)
+async def cb_admin_users(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    page, cursor = parse_page_args(args)
+    items_per_page = 10
+    total_users = await count_all_users_db(banned=False)
+    
+    kb = await get_pagination_kb("admin_users", page, total_users, items_per_page, get_all_users_db, is_banned_list=False, cursor=cursor)
+    await callback.message.edit_text(USERS_HEADER_TEXT, reply_markup=kb)
+    await callback.answer()
 
-    # report_action (approve/reject)
-    if callback.data.startswith("report_action:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        action = callback.data.split(":")[1]
-        report_id = int(callback.data.split(":")[2])
-        
-        report = await get_report_by_id(report_id)
-        if report:
-            new_status = "approved" if action == "approve" else "rejected"
-            await update_report_status(report_id, new_status)
-            
-            sender_user_data = await get_user_data(report['sender_id'])
-            sender_mention = await get_user_mention(report['sender_id'], report['sender_username'], sender_user_data['first_name'])
-            
-            # Уведомляем пользователя, который отправил жалобу
-            try:
-                if action == "approve":
-                    await bot.send_message(report['sender_id'], f"🟢 Жалоба №{report_id} одобрена!")
-                else:
-                    await bot.send_message(report['sender_id'], f"🔴 Жалоба №{report_id} отказана!")
-            except Exception as e:
-                logging.error(f"Не удалось отправить уведомление пользователю {report['sender_id']}: {e}")
-            
-            # Обновляем сообщение в админ-панели
-            target_mention = await get_user_mention(report['target_id'], report['target_username'], "Неизвестный")
-            await callback.message.edit_text(
-                f"№{report['report_id']} жалоба\n"
-                f"Причина: {report['reason']}\n"
-                f"ID отправителя: {report['sender_id']}\n"
-                f"Username отправителя: {sender_mention}\n"
-                f"ID/Username на кого подана жалоба: {target_mention}\n"
-                f"Статус: {'🟢 Одобрена' if action == 'approve' else '🔴 Отказана'}",
-                reply_markup=get_report_actions_kb(report_id) # Можно обновить на другую клавиатуру, без кнопок одобрения/отказа
-            )
-        await callback.answer()
-        return
+# admin_banlist
+@callback_route("admin_banlist", admin_only=True)
+async def cb_admin_banlist(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    page, cursor = parse_page_args(args)
+    items_per_page = 10
+    total_banned_users = await count_all_users_db(banned=True)
+    
+    kb = await get_pagination_kb("admin_banlist", page, total_banned_users, items_per_page, get_all_users_db, is_banned_list=True, cursor=cursor)
+    await callback.message.edit_text(BANLIST_HEADER_TEXT, reply_markup=kb)
+    await callback.answer()
 
-    # admin_users
-    if callback.data.startswith("admin_users:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        page = int(callback.data.split(":")[1])
-        items_per_page = 10
-        total_users = await count_all_users_db(banned=False)
+# view_user
+@callback_route("view_user", admin_only=True)
+async def cb_view_user(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    user_id = int(args[0])
+    user = await get_user_data(user_id)
+    if user:
+        user_mention = f"@{user['username']}" if user['username'] else f"ID: {user['user_id']}"
         
-        kb = await get_pagination_kb("admin_users", page, total_users, items_per_page, get_all_users_db, is_banned_list=False)
-        await callback.message.edit_text("Пользователи, зарегистрированные в боте:", reply_markup=kb)
-        await callback.answer()
-        return
+        from_banlist = False
+        if callback.message.text and BANLIST_HEADER_TEXT in callback.message.text: # Проверяем откуда пришел запрос
+            from_banlist = True
 
-    # admin_banlist
-    if callback.data.startswith("admin_banlist:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        page = int(callback.data.split(":")[1])
-        items_per_page = 10
-        total_banned_users = await count_all_users_db(banned=True)
+        await callback.message.edit_text(
+            render_user_profile(user_mention=user_mention, user_id=user['user_id'], reg_date=user['reg_date'], total_reports=user['total_reports']),
+            reply_markup=get_user_profile_kb(user_id, user['is_banned'], from_banlist),
+            parse_mode="HTML"
+        )
+    else:
+        await callback.message.edit_text(USER_NOT_FOUND_TEXT)
+    await callback.answer()
+
+# user_action (ban/unban)
+@callback_route("user_action", admin_only=True)
+async def cb_user_action(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    action = args[0]
+    target_user_id = int(args[1])
+    
+    target_user = await get_user_data(target_user_id)
+    if target_user:
+        target_mention = await get_user_mention(target_user['user_id'], target_user['username'], target_user['first_name'])
         
-        kb = await get_pagination_kb("admin_banlist", page, total_banned_users, items_per_page, get_all_users_db, is_banned_list=True)
-        await callback.message.edit_text("Пользователи в бан-листе:", reply_markup=kb)
-        await callback.answer()
-        return
+        if action == "ban":
+            await ban_user_db(target_user_id, None)
+            # ID сообщения о бане запишется, когда уведомление уйдёт
+            run_in_background(notify_banned(target_user_id, target_mention))
+            # Определяем, откуда пришел запрос, чтобы вернуться в нужный список
+            from_banlist = False
+            if callback.message.reply_markup and callback.message.reply_markup.inline_keyboard:
+                for row in callback.message.reply_markup.inline_keyboard:
+                    for button in row:
+                        if button.callback_data == "admin_banlist:0":
+                            from_banlist = True
+                            break
+                    if from_banlist: break
 
-    # view_user
-    if callback.data.startswith("view_user:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        user_id = int(callback.data.split(":")[1])
-        user = await get_user_data(user_id)
-        if user:
-            user_mention = f"@{user['username']}" if user['username'] else f"ID: {user['user_id']}"
+            await callback.message.edit_text(render_user_ban_changed(target_mention, True), reply_markup=get_user_profile_kb(target_user_id, True, from_banlist=from_banlist))
+        elif action == "unban":
+            ban_message_id = target_user['ban_message_id']
+            await unban_user_db(target_user_id)
+            run_in_background(notify_unbanned(target_user_id, target_mention, ban_message_id))
             
             from_banlist = False
-            if callback.message.text and "Пользователи в бан-листе:" in callback.message.text: # Проверяем откуда пришел запрос
-                from_banlist = True
-
-            await callback.message.edit_text(
-                f"👤 Username: **{user_mention}**\n"
-                f"🆔 ID: **{user['user_id']}**\n"
-                f"⏳ Время регистрации: **{user['reg_date'].strftime('%d.%m.%Y %H:%M:%S')}**\n"
-                f"🔢 Всего доносов: **{user['total_reports']}**\n"
-                f"🎂 Тариф: **Стандартный**", # Тариф не реализован, пока заглушка
-                reply_markup=get_user_profile_kb(user_id, user['is_banned'], from_banlist),
-                parse_mode="HTML"
-            )
-        else:
-            await callback.message.edit_text("Пользователь не найден.")
-        await callback.answer()
-        return
+            if callback.message.reply_markup and callback.message.reply_markup.inline_keyboard:
+                for row in callback.message.reply_markup.inline_keyboard:
+                    for button in row:
+                        if button.callback_data == "admin_banlist:0":
+                            from_banlist = True
+                            break
+                    if from_banlist: break
 
-    # user_action (ban/unban)
-    if callback.data.startswith("user_action:"):
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        action = callback.data.split(":")[1]
-        target_user_id = int(callback.data.split(":")[2])
-        
-        target_user = await get_user_data(target_user_id)
-        if target_user:
-            target_mention = await get_user_mention(target_user['user_id'], target_user['username'], target_user['first_name'])
-            
-            if action == "ban":
-                ban_msg = await bot.send_message(target_user_id, f"🛑 **{target_mention}**, Вы были заблокированы!\n❌ Теперь бот не будет отвечать на команды, сколько вы бы ни пытались.", parse_mode="HTML")
-                await ban_user_db(target_user_id, ban_msg.message_id)
-                # Определяем, откуда пришел запрос, чтобы вернуться в нужный список
-                from_banlist = False
-                if callback.message.reply_markup and callback.message.reply_markup.inline_keyboard:
-                    for row in callback.message.reply_markup.inline_keyboard:
-                        for button in row:
-                            if button.callback_data == "admin_banlist:0":
-                                from_banlist = True
-                                break
-                        if from_banlist: break
-
-                await callback.message.edit_text(f"Пользователь {target_mention} заблокирован.", reply_markup=get_user_profile_kb(target_user_id, True, from_banlist=from_banlist))
-            elif action == "unban":
-                await unban_user_db(target_user_id)
-                if target_user['ban_message_id']:
-                    try:
-                        await bot.delete_message(target_user_id, target_user['ban_message_id'])
-                    except TelegramBadRequest:
-                        logging.warning(f"Не удалось удалить сообщение о бане для {target_user_id}")
-                await bot.send_message(target_user_id, f"✅ **{target_mention}**, Вы были разблокированы!", parse_mode="HTML")
-                
-                from_banlist = False
-                if callback.message.reply_markup and callback.message.reply_markup.inline_keyboard:
-                    for row in callback.message.reply_markup.inline_keyboard:
-                        for button in row:
-                            if button.callback_data == "admin_banlist:0":
-                                from_banlist = True
-                                break
-                        if from_banlist: break
-
-                await callback.message.edit_text(f"Пользователь {target_mention} разблокирован.", reply_markup=get_user_profile_kb(target_user_id, False, from_banlist=from_banlist))
-        else:
-            await callback.message.edit_text("Пользователь не найден.")
-        await callback.answer()
-        return
-    
-    # admin_fast_approve (пока заглушка)
-    if callback.data == "admin_fast_approve":
-        if not await check_admin(callback.from_user.id):
-            await callback.answer("У вас нет доступа.", show_alert=True)
-            return
-        await callback.answer("Функция быстрого одобрения пока не реализована.", show_alert=True)
-        return
+            await callback.message.edit_text(render_user_ban_changed(target_mention, False), reply_markup=get_user_profile_kb(target_user_id, False, from_banlist=from_banlist))
+    else:
+        await callback.message.edit_text(USER_NOT_FOUND_TEXT)
+    await callback.answer()
 
-    # noop (пустая кнопка)
-    if callback.data == "noop":
-        await callback.answer()
+# admin_fast_approve: массовое решение всех ожидающих жалоб с выбранной причиной.
+# Кнопка ведёт на подтверждение (bulk_confirm), решает уже оно (bulk_reason).
+@callback_route("admin_fast_approve", admin_only=True)
+async def cb_admin_fast_approve(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    reasons = await get_pending_reasons()
+    builder = InlineKeyboardBuilder()
+    for row in reasons:
+        # "bulk_confirm:" длиннее "bulk_reason:" - если влезает он, влезет и кнопка подтверждения
+        if len(f"bulk_confirm:approve:{row['reason']}".encode()) > 64:
+            continue # Длинная своя причина не влезает в callback_data - такие жалобы решаются постранично
+        builder.row(
+            InlineKeyboardButton(text=f"🟢 {row['reason']} ({row['total']})", callback_data=f"bulk_confirm:approve:{row['reason']}"),
+            InlineKeyboardButton(text="🔴", callback_data=f"bulk_confirm:reject:{row['reason']}")
+        )
+    builder.row(BACK_TO_ADMIN_BUTTON)
+    text = FAST_APPROVE_TEXT if reasons else NO_PENDING_REPORTS_TEXT
+    await callback.message.edit_text(text, reply_markup=builder.as_markup())
+    await callback.answer()
+
+async def finish_bulk_action(callback: CallbackQuery, rows, action: str, back_data: str):
+    approved = action == "approve"
+    if rows:
+        run_in_background(notify_reports_resolved_bulk(rows, approved))
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text="◀️ Назад", callback_data=back_data))
+    builder.row(BACK_TO_ADMIN_BUTTON)
+    await callback.message.edit_text(render_bulk_done(approved, len(rows)), reply_markup=builder.as_markup())
+    await callback.answer()
+
+# bulk_page: все жалобы текущей страницы списка
+@callback_route("bulk_page", admin_only=True)
+async def cb_bulk_page(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    action = args[0]
+    rows = await resolve_reports_bulk("approved" if action == "approve" else "rejected", report_ids=decode_id_list(args[1]))
+    await finish_bulk_action(callback, rows, action, "admin_reports:0")
+
+# bulk_confirm: сколько жалоб будет решено - до того, как что-то менять
+@callback_route("bulk_confirm", admin_only=True)
+async def cb_bulk_confirm(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    action = args[0]
+    reason = ":".join(args[1:]) # Своя причина может содержать ":"
+    total = await count_pending_by_reason(reason)
+    if not total:
+        await callback.answer(BULK_NOTHING_LEFT_TEXT, show_alert=True)
         return
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text="✅ Да", callback_data=f"bulk_reason:{action}:{reason}"),
+        InlineKeyboardButton(text="◀️ Отмена", callback_data="admin_fast_approve")
+    )
+    await callback.message.edit_text(render_bulk_confirm(action == "approve", reason, total), reply_markup=builder.as_markup())
+    await callback.answer()
+
+# bulk_reason: все ожидающие жалобы с указанной причиной (после bulk_confirm)
+@callback_route("bulk_reason", admin_only=True)
+async def cb_bulk_reason(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    action = args[0]
+    reason = ":".join(args[1:]) # Своя причина может содержать ":"
+    rows = await resolve_reports_bulk("approved" if action == "approve" else "rejected", reason=reason)
+    await finish_bulk_action(callback, rows, action, "admin_fast_approve")
+
+# noop (пустая кнопка)
+@callback_route("noop")
+async def cb_noop(callback: CallbackQuery, state: FSMContext, args: list[str]):
+    await callback.answer()
 
 # Обработчик message (после проверки на бан)
-async def process_message(message: types.Message, state: FSMContext):
-    current_state = await state.get_state()
+async def process_message(message: types.Message, state: FSMContext, current_state: str | None):
+    # current_state - raw_state, уже прочитанный FSM-мидлварью: повторно в хранилище не ходим
+
+    # Поисковый запрос админа
+    if current_state == AdminStates.waiting_for_search:
+        await state.clear()
+        if not await check_admin(message.from_user.id) or not message.text:
+            return
+        # Запрос едет в callback_data кнопок пагинации - обрезаем, чтобы уложиться в 64 байта
+        query = message.text.strip()
+        while len(f"search:999:{query}".encode()) > 64:
+            query = query[:-1]
+        kb, found = await get_search_results_kb(query, 0)
+        await message.answer(render_search_results(query, found), reply_markup=kb)
+        return
 
     # Состояние для ввода собственной причины жалобы
     if current_state == ReportStates.waiting_for_custom_reason:
         custom_reason = message.text
         if len(custom_reason) > 16:
-            await message.answer("🛑 Ошибка! Много символов. Введите жалобу до 16 символов:")
+            await message.answer(CUSTOM_REASON_TOO_LONG_TEXT)
             return # Остаемся в том же состоянии
         
         await state.update_data(reason=custom_reason) # Сохраняем пользовательскую причину
-        await message.answer("Теперь, пожалуйста, ответьте на сообщение пользователя, на которого подаете жалобу, или введите его ID/Username:")
+        await message.answer(ASK_TARGET_AFTER_REASON_TEXT)
         await state.set_state(ReportStates.waiting_for_target) # Переходим в состояние ожидания цели
         return
 
@@ -599,24 +2590,27 @@ async def process_message(message: types.Message, state: FSMContext):
                 try:
                     target_id = int(message.text)
                 except ValueError:
-                    await message.answer("Некорректный ID пользователя. Пожалуйста, введите числовой ID или @username.")
+                    await message.answer(INVALID_TARGET_ID_TEXT)
                     return
         else:
-            await message.answer("Не удалось определить пользователя, на которого подается жалоба. Пожалуйста, ответьте на сообщение или введите ID/Username.")
+            await message.answer(TARGET_NOT_DETECTED_TEXT)
+            return
+
+        # Если дошли сюда, значит цель определена. Лимит проверяем до любой записи в БД и уведомления админу
+        wait = report_limiter.acquire(message.from_user.id)
+        if wait > 0:
+            await message.answer(render_rate_limited(wait))
             return
 
-        # Если дошли сюда, значит цель определена
         sender_mention = await get_user_mention(message.from_user.id, message.from_user.username, message.from_user.first_name)
         
         # Отправляем сообщение пользователю
         sent_msg_user = await message.answer(
-            f"Отправил: {sender_mention}\n"
-            f"Причина: {reason}\n"
-            f"Статус: 🟡 Ждет одобрения..",
+            render_report_sent(sender_mention=sender_mention, reason=reason),
             reply_markup=get_report_sent_kb(ADMIN_USERNAME)
         )
         
-        report_id, report_time = await add_report(
+        report_id, report_time, status, duplicate = await add_report(
             message.from_user.id,
             message.from_user.username,
             reason,
@@ -624,35 +2618,108 @@ async def process_message(message: types.Message, state: FSMContext):
             target_username,
             sent_msg_user.message_id
         )
-        await increment_user_reports(message.from_user.id)
 
-        # Отправляем уведомление админу
-        if ADMIN_ID: # Уведомление отправляем только если ADMIN_ID установлен
-            target_mention_admin = await get_user_mention(target_id, target_username, "Неизвестный")
-            await bot.send_message(
-                ADMIN_ID,
-                f"📩 **Новая жалоба!**\n"
-                f"**Данные:**\n"
-                f"👤 Username: {sender_mention}\n"
-                f"🆔 ID: {message.from_user.id}\n"
-                f"📄 Текст жалобы: {reason}\n"
-                f"🎯 На цель: {target_mention_admin}\n"
-                f"⏳ Время жалобы: {report_time.strftime('%d.%m.%Y | %H:%M:%S')}",
-                parse_mode="HTML"
+        if duplicate:
+            # Такая жалоба уже есть - новую строку не создаём и админа повторно не дёргаем
+            await sent_msg_user.edit_text(
+                render_report_duplicate(sender_mention=sender_mention, reason=reason, report_id=report_id,
+                                        status=STATUS_TEXTS.get(status, STATUS_PENDING_TEXT)),
+                reply_markup=get_report_sent_kb(ADMIN_USERNAME)
             )
+            await state.clear()
+            return
+
+        # Уведомление админу отправляем в фоне (или копим в сводку при всплеске), пользователь его не ждёт
+        if ADMIN_ID: # Уведомление отправляем только если ADMIN_ID установлен
+            admin_notifier.new_report(report_id, sender_mention, message.from_user.id, reason, target_id, target_username, report_time)
         
         await state.clear() # Сбрасываем состояние
         return
     
     # Если сообщение не является ответом на запрос состояния, просто игнорируем его
     # или можно добавить какой-то дефолтный ответ
-    await message.answer("Извините, я не понял вашу команду. Используйте кнопки.")
+    await message.answer(UNKNOWN_COMMAND_TEXT)
+
+
+async def health(request: web.Request):
+    return web.json_response({"status": "ok", "mode": BOT_MODE})
 
+async def run_webhook():
+    # Для локальной проверки достаточно POST'нуть JSON апдейта на WEBHOOK_PATH с заголовком секрета
+    if not WEBHOOK_SECRET:
+        logging.warning("Переменная WEBHOOK_SECRET не установлена. Webhook будет принимать запросы без проверки секрета.")
+    app = web.Application()
+    app.router.add_get("/health", health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logging.info(f"Webhook слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    if WEBHOOK_URL:
+        await bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+    # Работаем до SIGTERM/SIGINT: выходим штатно, чтобы main дописал очереди и закрыл сервер
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError: # Windows - остаётся KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+        logging.info("Получен сигнал остановки, завершаем работу")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+        await runner.cleanup()
 
 async def main():
     await init_db()
+    flush_task = asyncio.create_task(registration_flush_loop())
+    cleanup_task = asyncio.create_task(fsm_cleanup_loop()) if FSM_STORAGE == "postgres" else None
+    archive_task = asyncio.create_task(report_archive_loop()) if REPORT_ARCHIVE_AFTER_DAYS > 0 else None
+    rate_limit_task = None
+    if RATE_LIMIT_PERSIST:
+        for limiter in rate_limiters:
+            await limiter.load()
+        rate_limit_task = asyncio.create_task(rate_limit_flush_loop())
+    digest_task = asyncio.create_task(admin_digest_loop()) if ADMIN_ID and ADMIN_DIGEST_THRESHOLD > 0 else None
+    cache_listen_task = asyncio.create_task(user_cache_listen_loop()) if USER_CACHE_LISTEN else None
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
     logging.info("Бот запущен!")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        flush_task.cancel()
+        if cleanup_task:
+            cleanup_task.cancel()
+        if archive_task:
+            archive_task.cancel()
+        if rate_limit_task:
+            rate_limit_task.cancel()
+            for limiter in rate_limiters:
+                await limiter.flush()
+        if digest_task:
+            digest_task.cancel()
+            await admin_notifier.flush() # Накопленная сводка не должна пропасть при остановке
+        if cache_listen_task:
+            cache_listen_task.cancel()
+        if background_tasks: # Дожидаемся отправки уже поставленных уведомлений
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+        await flush_registrations() # Не теряем накопленные изменения профилей при остановке
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        # start_polling и shutdown webhook'а уже закрыли сессию, но сводка и фоновые отправки выше
+        # открывают её заново - закрываем последней, иначе при выходе "Unclosed client session"
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,30 @@
+# Тесты чистой логики бота: без Postgres и Telegram. Модуль грузится так же, как в бенчмарках.
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+from botmodule import load_bot
+
+@pytest.fixture(scope="session")
+def bot_module():
+    return load_bot(DATABASE_URL="postgresql://localhost/test", METRICS_PORT="0")
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Подменяет time.monotonic, которым пользуются ведра, кэш и фильтр логов
+    fake = FakeClock()
+    monkeypatch.setattr(time, "monotonic", fake)
+    return fake
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+REPORT_TIME = datetime(2024, 5, 1, 12, 30, 0)
+
+@pytest.fixture
+def sent_alerts(bot_module, monkeypatch):
+    # Одиночные уведомления не отправляем, а только запоминаем
+    alerts = []
+    monkeypatch.setattr(bot_module, "notify_admin_new_report", lambda mention, sender_id, reason, *args: reason)
+    monkeypatch.setattr(bot_module, "run_in_background", alerts.append)
+    return alerts
+
+def report(notifier, report_id: int, reason: str = "Спам"):
+    notifier.new_report(report_id, "@sender", 10, reason, None, "target", REPORT_TIME)
+
+def test_reports_below_threshold_are_sent_one_by_one(bot_module, clock, sent_alerts):
+    notifier = bot_module.AdminNotifier(threshold=3, interval=60, max_ids=10)
+    for report_id in range(3):
+        report(notifier, report_id)
+        clock.advance(30)
+    assert len(sent_alerts) == 3
+    assert notifier._pending == 0
+
+def test_burst_goes_to_digest(bot_module, clock, sent_alerts):
+    notifier = bot_module.AdminNotifier(threshold=2, interval=60, max_ids=2)
+    report(notifier, 1)
+    report(notifier, 2)
+    report(notifier, 3, "Оскорбления")
+    clock.advance(120)
+    report(notifier, 4) # Порог уже не превышен, но сводка ещё не отправлена - жалоба идёт в неё
+    assert sent_alerts == ["Спам", "Спам"]
+    assert notifier._pending == 2
+    assert notifier._reasons == {"Оскорбления": 1, "Спам": 1}
+    assert list(notifier._ids) == [3, 4]
+    assert notifier._since == REPORT_TIME
+
+def test_digest_escapes_reasons(bot_module, clock, sent_alerts, monkeypatch):
+    notifier = bot_module.AdminNotifier(threshold=1, interval=60, max_ids=10)
+    messages = []
+    async def send_message(chat_id, text, **kwargs):
+        messages.append(text)
+    monkeypatch.setattr(bot_module.bot, "send_message", send_message)
+    report(notifier, 1)
+    report(notifier, 2, "<b>x</b>")
+    asyncio.run(notifier.flush())
+    assert "&lt;b&gt;x&lt;/b&gt;: 1" in messages[0]
+    assert "№2" in messages[0]
+    assert notifier._pending == 0 and notifier.digests == 1
+
+def test_failed_digest_is_restored_before_newer_reports(bot_module, clock, sent_alerts):
+    notifier = bot_module.AdminNotifier(threshold=1, interval=60, max_ids=3)
+    report(notifier, 1)
+    report(notifier, 2)
+    report(notifier, 3, "Оскорбления")
+    pending, reasons, ids, since = notifier._pending, notifier._reasons, list(notifier._ids), notifier._since
+    notifier._pending, notifier._reasons, notifier._since = 0, {}, None
+    notifier._ids.clear()
+    report(notifier, 4) # Пришла, пока отправлялась сводка
+    notifier._restore(pending, reasons, ids, since)
+    assert notifier._pending == 3
+    assert notifier._reasons == {"Спам": 2, "Оскорбления": 1}
+    assert list(notifier._ids) == [2, 3, 4] # Самые старые вытесняются первыми
+    assert notifier._since == REPORT_TIME
@@ -0,0 +1,37 @@
+import logging
+
+def warning(lineno: int = 1) -> logging.LogRecord:
+    return logging.LogRecord("bot", logging.WARNING, "bot.py", lineno, "msg", None, None)
+
+def test_sampling_passes_burst_then_every_nth(bot_module, clock):
+    sampler = bot_module.LogSamplingFilter(burst=2, every=3, window=60)
+    records = [warning() for _ in range(8)]
+    passed = [sampler.filter(record) for record in records]
+    assert passed == [True, True, False, False, True, False, False, True]
+    assert getattr(records[4], "sampled", None) == 3
+    assert not hasattr(records[0], "sampled")
+    assert sampler.filter(warning(lineno=2)) # Другое место в коде - свой счётчик
+
+def test_sampling_window_restarts_and_errors_pass(bot_module, clock):
+    sampler = bot_module.LogSamplingFilter(burst=1, every=100, window=60)
+    assert sampler.filter(warning())
+    assert not sampler.filter(warning())
+    error = logging.LogRecord("bot", logging.ERROR, "bot.py", 1, "msg", None, None)
+    assert all(sampler.filter(error) for _ in range(5))
+    clock.advance(60)
+    assert sampler.filter(warning())
+
+def test_histogram_render_is_cumulative(bot_module):
+    histogram = bot_module.Histogram("handler_seconds", "Время обработки", labels=("handler",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, 'say "hi"')
+    labels = 'handler="say \\"hi\\""'
+    assert histogram.render() == [
+        "# HELP handler_seconds Время обработки",
+        "# TYPE handler_seconds histogram",
+        f'handler_seconds_bucket{{{labels},le="0.1"}} 2',
+        f'handler_seconds_bucket{{{labels},le="1.0"}} 3',
+        f'handler_seconds_bucket{{{labels},le="+Inf"}} 4',
+        f"handler_seconds_sum{{{labels}}} 3.65",
+        f"handler_seconds_count{{{labels}}} 4",
+    ]
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageText, SendMessage
+
+def make_scheduler(bot_module, **overrides):
+    options = dict(global_rate=1000, chat_rate=1000, chat_burst=1000, max_retries=3, backoff_chats=2, backoff_window=60)
+    options.update(overrides)
+    return bot_module.OutboundScheduler(**options)
+
+async def send_all(scheduler, make_request, methods):
+    try:
+        return await asyncio.gather(*(scheduler(make_request, None, method) for method in methods), return_exceptions=True)
+    finally:
+        scheduler._worker.cancel()
+
+def flaky(failures: dict, retry_after: int = 0):
+    # Первые failures[chat_id] запросов в чат получают 429
+    calls = []
+    async def make_request(bot, method):
+        calls.append(method.chat_id)
+        if failures.get(method.chat_id, 0) > 0:
+            failures[method.chat_id] -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+        return method.chat_id
+    return make_request, calls
+
+def test_retry_after_blocks_only_that_chat(bot_module):
+    scheduler = make_scheduler(bot_module)
+    make_request, calls = flaky({1: 1})
+    results = asyncio.run(send_all(scheduler, make_request, [SendMessage(chat_id=1, text="a"), SendMessage(chat_id=2, text="b")]))
+    assert results == [1, 2]
+    assert calls.count(1) == 2 and calls.count(2) == 1
+    assert scheduler._chats[1].blocked_until > 0
+    assert scheduler._chats[2].blocked_until == 0
+    assert scheduler.global_bucket.blocked_until == 0
+
+def test_retry_after_in_several_chats_blocks_everything(bot_module):
+    scheduler = make_scheduler(bot_module, backoff_chats=2)
+    make_request, _ = flaky({1: 1, 2: 1})
+    results = asyncio.run(send_all(scheduler, make_request, [SendMessage(chat_id=1, text="a"), SendMessage(chat_id=2, text="b")]))
+    assert results == [1, 2]
+    assert scheduler.global_bucket.blocked_until > 0
+
+def test_gives_up_after_max_retries(bot_module):
+    scheduler = make_scheduler(bot_module, max_retries=1)
+    make_request, calls = flaky({1: 10})
+    results = asyncio.run(send_all(scheduler, make_request, [SendMessage(chat_id=1, text="a")]))
+    assert isinstance(results[0], TelegramRetryAfter)
+    assert len(calls) == 2
+
+def test_note_retry_counts_distinct_chats_in_window(bot_module):
+    scheduler = make_scheduler(bot_module, backoff_window=10)
+    assert scheduler._note_retry(1, 100) == 1
+    assert scheduler._note_retry(1, 101) == 1
+    assert scheduler._note_retry(2, 105) == 2
+    assert scheduler._note_retry(3, 112) == 2 # Чат 1 выпал из окна
+
+def test_chat_limit_applies_to_sends_but_not_edits(bot_module):
+    scheduler = make_scheduler(bot_module, chat_rate=10, chat_burst=1)
+    make_request, _ = flaky({})
+
+    async def timed(methods):
+        start = time.monotonic()
+        await asyncio.gather(*(scheduler(make_request, None, method) for method in methods))
+        return time.monotonic() - start
+
+    async def scenario():
+        # Один event loop на весь сценарий: очередь планировщика привязывается к циклу
+        try:
+            edits = await timed([EditMessageText(chat_id=1, message_id=1, text="a") for _ in range(5)])
+            sends = await timed([SendMessage(chat_id=1, text="a") for _ in range(3)])
+        finally:
+            scheduler._worker.cancel()
+        return edits, sends
+
+    edits, sends = asyncio.run(scenario())
+    assert edits < 0.1
+    assert sends >= 0.15 # Первое сразу, дальше по одному в 0.1 с
+
+def test_requests_without_chat_bypass_queue(bot_module):
+    scheduler = make_scheduler(bot_module)
+    class Method:
+        chat_id = None
+    async def make_request(bot, method):
+        return "ok"
+    assert asyncio.run(scheduler(make_request, None, Method())) == "ok"
+    assert scheduler._worker is None
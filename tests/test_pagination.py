@@ -0,0 +1,19 @@
+from datetime import datetime
+
+def test_page_callback_round_trip(bot_module):
+    sort_value = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    data = bot_module.encode_page_callback("admin_reports", 3, "n", sort_value, 98765)
+    prefix, *args = data.split(":")
+    assert prefix == "admin_reports"
+    assert bot_module.parse_page_args(args) == (3, ("n", sort_value, 98765))
+    assert len(data.encode()) <= 64
+
+def test_first_page_has_no_cursor(bot_module):
+    assert bot_module.parse_page_args(["0"]) == (0, None)
+
+def test_id_list_round_trip(bot_module):
+    ids = [0, 1, 35, 36, 123456789, 2 ** 62]
+    data = bot_module.encode_id_list(ids)
+    assert data.split(".")[:4] == ["0", "1", "z", "10"]
+    assert bot_module.decode_id_list(data) == ids
+    assert bot_module.decode_id_list("") == []
@@ -0,0 +1,41 @@
+def test_token_bucket_refills_at_rate(bot_module, clock):
+    bucket = bot_module.TokenBucket(rate=2, capacity=2)
+    now = clock.now
+    assert bucket.delay(now) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0
+    assert bucket.delay(now + 10) == 0 and bucket.tokens == 2 # Не больше capacity
+
+def test_token_bucket_block_overrides_available_tokens(bot_module, clock):
+    bucket = bot_module.TokenBucket(rate=1, capacity=5)
+    now = clock.now
+    bucket.block(now, 3)
+    bucket.block(now, 1) # Более короткий блок не сокращает уже действующий
+    assert bucket.delay(now) == 3
+    assert bucket.delay(now + 3) == 0
+
+def test_sender_limiter_spends_only_available_attempts(bot_module, clock):
+    limiter = bot_module.SenderRateLimiter("test", limit=2, period=60)
+    assert limiter.acquire(1) == 0
+    assert limiter.acquire(1) == 0
+    assert limiter.acquire(1) == 30 # Одна попытка за period / limit секунд
+    assert limiter.acquire(2) == 0 # У другого отправителя своё ведро
+    clock.advance(30)
+    assert limiter.retry_after(1) == 0
+    assert limiter.retry_after(1) == 0 # retry_after не списывает
+    assert limiter.acquire(1) == 0
+    assert limiter.acquire(1) == 30
+    assert limiter._dirty == {1, 2}
+
+def test_sender_limiter_keeps_at_most_max_senders(bot_module, clock):
+    limiter = bot_module.SenderRateLimiter("test", limit=1, period=60, max_senders=2)
+    for sender_id in (1, 2, 3):
+        limiter.acquire(sender_id)
+    assert list(limiter._buckets) == [2, 3]
+
+def test_format_wait(bot_module):
+    assert bot_module.format_wait(0.2) == "1 с."
+    assert bot_module.format_wait(59.5) == "60 с."
+    assert bot_module.format_wait(60) == "2 мин."
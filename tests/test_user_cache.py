@@ -0,0 +1,35 @@
+def test_get_returns_cached_value_and_none_for_missing_user(bot_module, clock):
+    cache = bot_module.UserCache(max_size=10, ttl=60)
+    assert cache.get(1) == (False, None)
+    cache.set(1, {"username": "a"})
+    cache.set(2, None) # Пользователя нет в БД - это тоже кэшируется
+    assert cache.get(1) == (True, {"username": "a"})
+    assert cache.get(2) == (True, None)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_entry_expires_after_ttl(bot_module, clock):
+    cache = bot_module.UserCache(max_size=10, ttl=60)
+    cache.set(1, {"username": "a"})
+    clock.advance(60)
+    assert cache.get(1)[0]
+    clock.advance(1)
+    assert cache.get(1) == (False, None)
+    assert 1 not in cache._data
+
+def test_least_recently_used_entry_is_evicted(bot_module, clock):
+    cache = bot_module.UserCache(max_size=2, ttl=60)
+    cache.set(1, {})
+    cache.set(2, {})
+    cache.get(1) # 1 теперь свежее, чем 2
+    cache.set(3, {})
+    assert cache.get(2) == (False, None)
+    assert cache.get(1)[0] and cache.get(3)[0]
+
+def test_update_changes_cached_fields_and_forgets_unknown(bot_module, clock):
+    cache = bot_module.UserCache(max_size=10, ttl=60)
+    cache.set(1, {"username": "a", "first_name": "A"})
+    cache.set(2, None)
+    cache.update(1, username="b")
+    cache.update(2, username="c")
+    assert cache.get(1) == (True, {"username": "b", "first_name": "A"})
+    assert cache.get(2) == (False, None)